@@ -0,0 +1,313 @@
+from math import atan2, pi
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from Network import Network, Node, Edge, Point, opposite_port
+
+# The same network as in Network.py, but held in a handful of arrays indexed by integer
+# node and edge ids instead of one Python object (with lists of its own) per node and
+# edge. Adjacency is CSR: the edges at node i are adj_edge[adj_start[i]:adj_start[i+1]],
+# in the same order as Node.edges, and adj_end says which end of each edge node i is.
+# Ports are int8 with -1 for unassigned, bends are NaN when there is none.
+#
+# Names, labels, colors, geo_pos and the structure (edge_nodes, adjacency) are shared
+# between clones and are only ever replaced, never changed in place.
+#
+# For code written against Network, net.nodes and net.edges hand out small views with
+# the same interface as Node and Edge; they are made on the fly and hold only an id.
+# Code that wants speed uses the arrays directly.
+
+no_port = -1
+
+class CompactNetwork:
+    def __init__(self, names, labels, pos, geo_pos, edge_nodes, colors, adjacency=None):
+        # adjacency: for every node the list of its edge ids (in order), or None for id order
+        n = len(names)
+        m = len(colors)
+        self.names = list(names)
+        self.labels = list(labels)
+        self.index = { name: i for i, name in enumerate(self.names) }
+        self.pos = np.array( pos, dtype=np.float64 ).reshape( n, 2 )
+        self.geo_pos = np.array( geo_pos, dtype=np.float64 ).reshape( n, 2 )
+        self.edge_nodes = np.array( edge_nodes, dtype=np.int32 ).reshape( m, 2 )
+        self.colors = list(colors)
+        self.port = np.full( (m,2), no_port, dtype=np.int8 )
+        self.bend = np.full( (m,2), np.nan )
+        # Edge id at each port of each node
+        self.node_ports = np.full( (n,8), -1, dtype=np.int16 if m<2**15 else np.int32 )
+        self.set_adjacency( adjacency )
+        self.nodes = NodeMap( self )
+        self.edges = EdgeList( self )
+
+    def set_adjacency( self, adjacency=None ):
+        n = len(self.names)
+        if adjacency is None:
+            # Every edge appears at both its ends, in order of edge id
+            ends = self.edge_nodes.T.reshape(-1)
+            edge_ids = np.tile( np.arange(len(self.colors),dtype=np.int32), 2 )
+            order = np.lexsort( (edge_ids, ends) )
+            self.adj_edge = edge_ids[order]
+            degree = np.bincount( ends, minlength=n )
+        else:
+            self.adj_edge = np.array( [ e for edges in adjacency for e in edges ], dtype=np.int32 )
+            degree = np.array( [ len(edges) for edges in adjacency ], dtype=np.int64 )
+        self.adj_start = np.zeros( n+1, dtype=np.int32 )
+        np.cumsum( degree, out=self.adj_start[1:] )
+        node_of_entry = np.repeat( np.arange(n,dtype=np.int32), degree )
+        self.adj_end = ( self.edge_nodes[self.adj_edge,0]!=node_of_entry ).astype( np.int8 )
+
+    @staticmethod
+    def from_network( net ):
+        names = list( net.nodes )
+        index = { name: i for i, name in enumerate(names) }
+        edge_index = { e: i for i, e in enumerate(net.edges) }
+        nodes = list( net.nodes.values() )
+        compact = CompactNetwork( names, [ v.label for v in nodes ],
+            [ (v.pos.x(),v.pos.y()) for v in nodes ],
+            [ (v.geo_pos.x(),v.geo_pos.y()) for v in nodes ],
+            [ (index[e.v[0].name],index[e.v[1].name]) for e in net.edges ],
+            [ e.color for e in net.edges ],
+            [ [ edge_index[e] for e in v.edges ] for v in nodes ] )
+        for i, e in enumerate(net.edges):
+            for end in (0,1):
+                if e.port[end] is not None: compact.port[i,end] = e.port[end]
+            if e.bend is not None: compact.bend[i] = (e.bend.x(),e.bend.y())
+        for i, v in enumerate(nodes):
+            for p, e in enumerate(v.ports):
+                if e is not None: compact.node_ports[i,p] = edge_index[e]
+        return compact
+
+    def to_network( self ):
+        net = Network()
+        for i, name in enumerate(self.names):
+            v = Node( self.pos[i,0], self.pos[i,1], name, self.labels[i] )
+            v.geo_pos = Point( self.geo_pos[i,0], self.geo_pos[i,1] )
+            net.nodes[name] = v
+        nodes = list( net.nodes.values() )
+        for i, (a, b) in enumerate(self.edge_nodes.tolist()):
+            e = Edge( nodes[a], nodes[b] )
+            e.color = self.colors[i]
+            e.port = [ None if p==no_port else p for p in self.port[i].tolist() ]
+            if not np.isnan(self.bend[i,0]): e.bend = Point( *self.bend[i] )
+            net.edges.append( e )
+        for i, v in enumerate(nodes):
+            v.edges = [ net.edges[e] for e in self.adj_edge[self.adj_start[i]:self.adj_start[i+1]].tolist() ]
+            v.ports = [ None if e<0 else net.edges[e] for e in self.node_ports[i].tolist() ]
+        return net
+
+    def clone( self ):
+        other = CompactNetwork.__new__( CompactNetwork )
+        other.__dict__.update( self.__dict__ )
+        for key in ('pos','port','bend','node_ports'):
+            setattr( other, key, getattr(self,key).copy() )
+        other.nodes = NodeMap( other )
+        other.edges = EdgeList( other )
+        return other
+
+    ### Whole-network operations, on the arrays ###
+
+    def degrees( self ):
+        return np.diff( self.adj_start )
+
+    def adjacency_matrix( self ):
+        # Node adjacency for scipy.sparse.csgraph; entry (i,j) counts the edges between i and j
+        n = len(self.names)
+        neighbors = self.edge_nodes[ self.adj_edge, 1-self.adj_end ]
+        return csr_matrix( (np.ones(len(neighbors),dtype=np.int32), neighbors, self.adj_start), shape=(n,n) )
+
+    def neighbor_ids( self, i ):
+        s, t = self.adj_start[i], self.adj_start[i+1]
+        return self.edge_nodes[ self.adj_edge[s:t], 1-self.adj_end[s:t] ]
+
+    def edge_vectors( self, geo=False ):
+        # Vector from the first to the second node of every edge
+        pos = self.geo_pos if geo else self.pos
+        return pos[self.edge_nodes[:,1]] - pos[self.edge_nodes[:,0]]
+
+    def edge_angles( self, geo=False ):
+        # Angle of every edge at both its ends, as in Edge.angle (CCW, 0 = left)
+        d = self.edge_vectors( geo )
+        at_first = pi - np.arctan2( d[:,1], d[:,0] )
+        at_second = pi - np.arctan2( -d[:,1], -d[:,0] )
+        return np.stack( (at_first, at_second), axis=1 )
+
+    def scale_by_shortest_edge( self, lb ):
+        factor = lb/np.sqrt( (self.edge_vectors(geo=True)**2).sum(axis=1) ).min()
+        self.pos = self.pos*factor
+        self.geo_pos = self.geo_pos*factor
+
+    def evict_all_edges( self ):
+        self.port[:] = no_port
+        self.node_ports[:] = -1
+        self.bend[:] = np.nan
+
+
+### VIEWS ###
+
+class NodeMap:
+    # Name -> node view, like Network.nodes
+    __slots__ = ('net',)
+    def __init__(self, net): self.net = net
+    def __getitem__(self, name): return NodeView( self.net, self.net.index[name] )
+    def __contains__(self, name): return name in self.net.index
+    def __iter__(self): return iter( self.net.names )
+    def __len__(self): return len( self.net.names )
+    def keys(self): return iter( self.net.names )
+    def values(self): return ( NodeView(self.net,i) for i in range(len(self.net.names)) )
+    def items(self): return ( (name,NodeView(self.net,i)) for i, name in enumerate(self.net.names) )
+
+class EdgeList:
+    # Like Network.edges
+    __slots__ = ('net',)
+    def __init__(self, net): self.net = net
+    def __getitem__(self, i): return EdgeView( self.net, range(len(self.net.colors))[i] )
+    def __iter__(self): return ( EdgeView(self.net,i) for i in range(len(self.net.colors)) )
+    def __len__(self): return len( self.net.colors )
+    def index(self, e): return e.i
+
+class NodeView:
+    __slots__ = ('net','i')
+    def __init__(self, net, i):
+        self.net = net
+        self.i = int(i)
+    def __eq__(self, other): return isinstance(other,NodeView) and self.i==other.i and self.net is other.net
+    def __hash__(self): return hash( (id(self.net),self.i) )
+
+    @property
+    def name(self): return self.net.names[self.i]
+    @property
+    def label(self): return self.net.labels[self.i]
+    @property
+    def pos(self): return Point( *self.net.pos[self.i] )
+    @pos.setter
+    def pos(self, p): self.net.pos[self.i] = (p.x(),p.y())
+    @property
+    def geo_pos(self): return Point( *self.net.geo_pos[self.i] )
+    @geo_pos.setter
+    def geo_pos(self, p):
+        self.net.geo_pos = self.net.geo_pos.copy() # shared with clones
+        self.net.geo_pos[self.i] = (p.x(),p.y())
+    @property
+    def edges(self):
+        net = self.net
+        return [ EdgeView(net,e) for e in net.adj_edge[net.adj_start[self.i]:net.adj_start[self.i+1]].tolist() ]
+    @property
+    def ports(self):
+        return [ None if e<0 else EdgeView(self.net,e) for e in self.net.node_ports[self.i].tolist() ]
+
+    def set_position( self, x, y ):
+        self.net.pos[self.i] = (x,y)
+
+    def neighbors(self):
+        return [ NodeView(self.net,j) for j in self.net.neighbor_ids(self.i).tolist() ]
+
+    def assign(self, e, i, force=False) -> bool:
+        net = self.net
+        occupant = net.node_ports[self.i,i]
+        if occupant>=0:
+            if force: self.evict( EdgeView(net,occupant) )
+            else: return False
+        me = e.id(self)
+        old_port = net.port[e.i,me]
+        if old_port!=no_port: net.node_ports[self.i,old_port] = -1
+        net.port[e.i,me] = i
+        net.node_ports[self.i,i] = e.i
+        return True
+
+    def assign_both_ends( self, e, i, force=False ):
+        self.assign(e,i,force)
+        e.other(self).assign( e, opposite_port(i), force )
+
+    def evict( self, e ):
+        net = self.net
+        me = e.id(self)
+        p = net.port[e.i,me]
+        assert net.node_ports[self.i,p]==e.i
+        net.node_ports[self.i,p] = -1
+        net.port[e.i,me] = no_port
+        net.bend[e.i] = np.nan
+
+    def try_evict( self, e ):
+        if not e.free_at(self): self.evict(e)
+
+    # The rest of Node works on these views as is
+    straighten_deg2 = Node.straighten_deg2
+    is_straight_through = Node.is_straight_through
+    is_right_angle = Node.is_right_angle
+    smoothen = Node.smoothen
+
+class EdgePorts:
+    # Like Edge.port: a pair of ports, with None for unassigned
+    __slots__ = ('net','i')
+    def __init__(self, net, i):
+        self.net = net
+        self.i = i
+    def __getitem__(self, end):
+        p = self.net.port[self.i,end]
+        return None if p==no_port else int(p)
+    def __setitem__(self, end, p):
+        self.net.port[self.i,end] = no_port if p is None else p
+    def __iter__(self): return iter( (self[0],self[1]) )
+    def __len__(self): return 2
+
+class EdgeView:
+    __slots__ = ('net','i')
+    def __init__(self, net, i):
+        self.net = net
+        self.i = int(i)
+    def __eq__(self, other): return isinstance(other,EdgeView) and self.i==other.i and self.net is other.net
+    def __hash__(self): return hash( (id(self.net),self.i) )
+
+    @property
+    def v(self):
+        a, b = self.net.edge_nodes[self.i].tolist()
+        return ( NodeView(self.net,a), NodeView(self.net,b) )
+    @property
+    def port(self): return EdgePorts( self.net, self.i )
+    @property
+    def bend(self):
+        x, y = self.net.bend[self.i]
+        return None if x!=x else Point( x, y )
+    @bend.setter
+    def bend(self, p): self.net.bend[self.i] = (np.nan,np.nan) if p is None else (p.x(),p.y())
+    @property
+    def color(self): return self.net.colors[self.i]
+    @color.setter
+    def color(self, c):
+        self.net.colors = list(self.net.colors) # shared with clones
+        self.net.colors[self.i] = c
+
+    def id(self,v):
+        a, b = self.net.edge_nodes[self.i]
+        if a==v.i: return 0
+        if b==v.i: return 1
+        assert False
+    def other(self, v):
+        return NodeView( self.net, self.net.edge_nodes[self.i,1-self.id(v)] )
+    def port_at(self, v):
+        return self.port[self.id(v)]
+    def free_at(self,v):
+        return self.net.port[self.i,self.id(v)]==no_port
+
+    def vector(self,v):
+        pos = self.net.pos
+        return Point( *(pos[self.net.edge_nodes[self.i,1-self.id(v)]] - pos[v.i]) )
+    def geo_vector(self,v):
+        pos = self.net.geo_pos
+        return Point( *(pos[self.net.edge_nodes[self.i,1-self.id(v)]] - pos[v.i]) )
+    def direction(self,v):
+        return self.vector(v).normalized()
+    def geo_direction(self,v):
+        return self.geo_vector(v).normalized()
+
+    # CCW angles, start at 0 = left
+    def angle(self,v):
+        dir = self.vector(v)
+        return pi-atan2(dir.y(),dir.x())
+    def geo_angle(self,v):
+        dir = self.geo_vector(v)
+        return pi-atan2(dir.y(),dir.x())
+
+    def consistent_ports(self):
+        return self.port[0]==opposite_port(self.port[1])
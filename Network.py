@@ -1,11 +1,34 @@
-from math import inf, atan2, pi
-
-from PySide6.QtCore import QPointF
-from PySide6.QtGui import QVector2D
+from math import inf, atan2, pi, sqrt
 
 def opposite_port( p ):
     return (p+4)%8
 
+class Point:
+    # Plain float coordinates, so the core does not need Qt. Has the parts of the
+    # QPointF/QVector2D interface that the code uses; the GUI converts at its boundary.
+    __slots__ = ('_x','_y')
+    def __init__(self, x=0.0, y=0.0):
+        self._x = float(x)
+        self._y = float(y)
+    def x(self): return self._x
+    def y(self): return self._y
+
+    def __add__(self, other): return Point( self._x+other.x(), self._y+other.y() )
+    def __sub__(self, other): return Point( self._x-other.x(), self._y-other.y() )
+    def __neg__(self): return Point( -self._x, -self._y )
+    def __mul__(self, s): return Point( s*self._x, s*self._y )
+    __rmul__ = __mul__
+    def __truediv__(self, s): return Point( self._x/s, self._y/s )
+    def __eq__(self, other): return isinstance(other,Point) and self._x==other._x and self._y==other._y
+    def __hash__(self): return hash( (self._x,self._y) )
+    def __repr__(self): return f"Point({self._x}, {self._y})"
+
+    def length(self):
+        return sqrt( self._x*self._x + self._y*self._y )
+    def normalized(self):
+        length = self.length()
+        return self/length if length>0 else Point()
+
 class Network:
     def __init__(self):
         self.nodes = {}
@@ -49,7 +72,7 @@ class Network:
 
 class Node:
     def __init__(self, x, y, name: str, label:str = "" ):
-        self.pos = QPointF(x,y)
+        self.pos = Point(x,y)
         self.geo_pos = self.pos
         self.name = name
         self.label = label
@@ -57,7 +80,7 @@ class Node:
         self.ports = [None]*8
 
     def set_position( self, x, y ):
-        self.pos = QPointF(x,y)
+        self.pos = Point(x,y)
 
     def neighbors(self):
         return [e.other(self) for e in self.edges]
@@ -152,14 +175,14 @@ class Edge:
         return self.port[self.id(v)]==None
 
     def direction(self,v):
-        return QVector2D(self.v[1-self.id(v)].pos - v.pos).normalized()
+        return (self.v[1-self.id(v)].pos - v.pos).normalized()
     def geo_direction(self,v):
-        return QVector2D(self.v[1-self.id(v)].geo_pos - v.geo_pos).normalized()
+        return (self.v[1-self.id(v)].geo_pos - v.geo_pos).normalized()
     
     def vector(self,v):
-        return QVector2D(self.v[1-self.id(v)].pos - v.pos)
+        return self.v[1-self.id(v)].pos - v.pos
     def geo_vector(self,v):
-        return QVector2D(self.v[1-self.id(v)].geo_pos - v.geo_pos)
+        return self.v[1-self.id(v)].geo_pos - v.geo_pos
 
     # CCW angles, start at 0 = left
     def angle(self,v):
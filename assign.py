@@ -1,20 +1,41 @@
-from math import pi
+from math import pi, inf
 from time import perf_counter
 
-from mui import logline
+from log import logline
 
 from Network import *
 
 ### GEOGRAPHIC COST CALCULATIONS ###
 
-from numpy import matrix
-def angle_error( a, b ):
-    diff = abs(a-b) % (2*pi)
-    return min(diff, 2*pi-diff)
-def cost_matrix( v ):
-    port_angles = [ i*(pi/4) for i in range(8) ]
-    edge_angles = [ e.geo_angle(v) for e in v.edges ]
-    return matrix( [ [ angle_error(pa,ea)**2 for pa in port_angles ] for ea in edge_angles ] )
+import numpy as np
+port_angles = np.arange(8)*(pi/4)
+def cost_matrices( net ):
+    # The cost matrices of all nodes in one go: row start[i]+j holds the costs of the
+    # 8 ports for the j-th edge of the i-th node (in net.nodes order).
+    if hasattr( net, 'adj_start' ):
+        # CompactNetwork: the edge ends are in its arrays already
+        me = net.edge_nodes[ net.adj_edge, net.adj_end ]
+        other = net.edge_nodes[ net.adj_edge, 1-net.adj_end ]
+        geo_pos = net.geo_pos
+        start = net.adj_start
+    else:
+        index = { name: i for i, name in enumerate(net.nodes) }
+        geo_pos = np.array( [ (v.geo_pos.x(),v.geo_pos.y()) for v in net.nodes.values() ] ).reshape( -1, 2 )
+        me = []
+        other = []
+        degrees = []
+        for i, v in enumerate(net.nodes.values()):
+            for e in v.edges:
+                me.append( i )
+                other.append( index[e.other(v).name] )
+            degrees.append( len(v.edges) )
+        start = np.zeros( len(degrees)+1, dtype=np.int64 )
+        np.cumsum( degrees, out=start[1:] )
+    d = geo_pos[other] - geo_pos[me]
+    edge_angles = pi - np.arctan2( d[:,1], d[:,0] ) # as in Edge.geo_angle
+    # Squared angle between edge and port, either way around
+    diff = np.abs( edge_angles[:,None] - port_angles[None,:] ) % (2*pi)
+    return np.minimum( diff, 2*pi-diff )**2, start
 
 ### ROUNDING ###
 
@@ -29,67 +50,572 @@ def assign_by_rounding( net ):
 
 ### MATCHING ###
 
+# Instead of solving an assignment problem per node, try every way to give the edges of
+# a node distinct ports: a node of degree d has 8!/(8-d)! of those, listed once in a
+# table per degree. All nodes of the same degree are then matched at once by a few
+# gathers, a sum and an argmin. Past degree 4 the tables get big (up to 40320 ways) and
+# those few nodes are quicker with linear_sum_assignment.
+
+from itertools import permutations
 from scipy.optimize import linear_sum_assignment
+
+# Largest degree to match by table
+matching_table_degree = 4
+# How many costs to evaluate at once (bounds the memory of the batch)
+matching_batch_size = 2**22
+
+permutation_tables = dict() # degree -> (ways, degree) table of ports
+
+def permutation_table( degree ):
+    if degree not in permutation_tables:
+        permutation_tables[degree] = np.array( list(permutations(range(8),degree)), dtype=np.int64 ).reshape( -1, degree )
+    return permutation_tables[degree]
+
+def batch_matching( all_costs, start ):
+    # The best port for every edge end (rows of all_costs)
+    degrees = np.diff( start )
+    ports = np.full( len(all_costs), -1, dtype=np.int64 )
+    for degree in range( 1, matching_table_degree+1 ):
+        nodes = np.flatnonzero( degrees==degree )
+        if len(nodes)==0: continue
+        table = permutation_table( degree )
+        # Column j of flat picks the cost of edge j at its port in every way
+        flat = np.arange(degree)[None,:]*8 + table
+        rows = start[nodes][:,None] + np.arange(degree)[None,:]
+        chunk = max( 1, matching_batch_size//len(table) )
+        for first in range( 0, len(nodes), chunk ):
+            costs = all_costs[ rows[first:first+chunk] ].reshape( -1, degree*8 )
+            totals = costs[ :, flat[:,0] ]
+            for j in range( 1, degree ):
+                totals += costs[ :, flat[:,j] ]
+            ports[ rows[first:first+chunk] ] = table[ totals.argmin( axis=1 ) ]
+    for k in np.flatnonzero( degrees>matching_table_degree ):
+        matched, cols = linear_sum_assignment( all_costs[ start[k]:start[k+1] ] )
+        ports[ start[k]+matched ] = cols
+    return ports
+
 def assign_by_local_matching( net ):
     net.evict_all_edges()
-    for v in net.nodes.values():
-        costs = cost_matrix(v)
-        _, cols = linear_sum_assignment(costs)
-        for i,p in enumerate(cols):
-            v.assign( v.edges[int(i)], int(p) )
+    all_costs, start = cost_matrices(net)
+    ports = batch_matching( all_costs, start )
+    if hasattr( net, 'adj_start' ) and (ports>=0).all(): # (not so for degree over 8)
+        # CompactNetwork: write the ports straight into its arrays
+        net.port[ net.adj_edge, net.adj_end ] = ports
+        net.node_ports[ np.repeat( np.arange(len(net.names)), np.diff(start) ), ports ] = net.adj_edge
+        return
+    for k, v in enumerate(net.nodes.values()):
+        for i, p in enumerate( ports[ start[k]:start[k+1] ].tolist() ):
+            if p>=0: v.assign( v.edges[i], p )
 
 
 ### INTEGER LINEAR PROGRAMMING ###
 
 from ortools.linear_solver import pywraplp as lp
-def assign_by_ilp( net, bend_cost=1 ):
+import solvers
+
+# Most ports are hopeless for a given edge, so the ILP only gets variables for the
+# candidates: at each end the best few ports and any port within some angle of the edge
+# (and the current port of locked edge ends). If that leaves no solution, the ILP is
+# solved again with all ports.
+ilp_candidates = 3             # best ports per edge end; 8 for no pruning
+ilp_candidate_angle = pi/4     # radians
+
+def assign_by_ilp( net, bend_cost=1, config:solvers.SolverConfig = None, locked=() ):
 
     # bend cost is relative to squared angle errors
+    # locked: (node, edge) pairs whose current port must remain possible
 
-    solver = lp.Solver.CreateSolver("SCIP")
+    config = config or solvers.assign_config
     start = perf_counter()
-    objective = solver.Sum([])
-    portvars = dict()
+    all_costs, ends = cost_matrices(net)
+    candidates = candidate_ports( net, all_costs, ends, ilp_candidates, ilp_candidate_angle, locked )
+    chains = degree2_chains( net ) if ilp_chains else []
+    status, choice = solve_ilp( net, all_costs, ends, candidates, bend_cost, config, chains )
+    if status not in (lp.Solver.OPTIMAL,lp.Solver.FEASIBLE) and ilp_candidates<8:
+        logline( "stats\tPort assignment ILP infeasible with pruned ports" )
+        candidates = [ set(range(8)) for e in net.edges ]
+        status, choice = solve_ilp( net, all_costs, ends, candidates, bend_cost, config, chains )
+    runtime = perf_counter()-start
+    logline( "pa-ilp\tPort assignment ILP runtime (s)\t" + str(runtime) )
+    print( 'Port assignment ILP runtime', runtime, 's' )
+    print( 'Solver status', status )
+    if status==lp.Solver.OPTIMAL or status==lp.Solver.FEASIBLE:
+        apply_choice( net, choice )
+    else:
+        print( 'Port assignment ILP infeasible' )
+        logline( "stats\tPort assignment ILP infeasible" )
+
+def apply_choice( net, choice ):
+    # choice: the port at the first node of every edge
+    net.evict_all_edges()
+    for e, p in zip( net.edges, choice ):
+        e.v[0].assign( e, p )
+        e.v[1].assign( e, opposite_port(p) )
+
+def candidate_ports( net, all_costs, ends, k, angle, locked=() ):
+    # For every edge, the ports at its first node that get a variable. A port at the
+    # second node is the opposite port at the first, so one set covers both ends.
+    locked = set( locked )
+    candidates = [ set() for e in net.edges ]
+    edge_index = { e: i for i, e in enumerate(net.edges) }
+    order = np.argsort( all_costs, axis=1, kind='stable' )
+    for n, v in enumerate(net.nodes.values()):
+        for j, e in enumerate(v.edges):
+            row = ends[n]+j
+            ports = set( order[row,:k].tolist() ) | set( np.flatnonzero( all_costs[row]<=angle*angle ).tolist() )
+            if (v,e) in locked and e.port_at(v) is not None: ports.add( e.port_at(v) )
+            first = e.v[0]==v
+            candidates[edge_index[e]].update( p if first else opposite_port(p) for p in ports )
+    return candidates
+
+def solve_ilp( net, all_costs, ends, candidates, bend_cost, config, chains=() ):
+    # One 0/1 variable per edge and candidate direction, and one per chain and pair of
+    # end headings; returns the status and the chosen port at the first node of every edge
+    solver = config.create()
+    infinity = solver.infinity()
+    objective = solver.Objective()
+    node_index = { v: n for n, v in enumerate(net.nodes.values()) }
+    def row( v, e ): return ends[node_index[v]] + v.edges.index(e)
+    uses = dict() # (node, edge) -> { port: variables that put the edge at that port }
+    def use( v, e, p, x ): uses.setdefault( (v,e), dict() ).setdefault( p, [] ).append( x )
+    in_chain = { e for a, path, b in chains for e, flipped in path }
+
+    edgevars = [ None ]*len(net.edges)
+    for i, e in enumerate(net.edges):
+        if e in in_chain: continue
+        xs = { p: solver.BoolVar(f'edge_{i}_{p}') for p in sorted(candidates[i]) }
+        # pick exactly one port for an edge
+        c = solver.Constraint( 1, 1 )
+        for p, x in xs.items():
+            c.SetCoefficient( x, 1 )
+            objective.SetCoefficient( x, all_costs[row(e.v[0],e),p] + all_costs[row(e.v[1],e),opposite_port(p)] )
+            use( e.v[0], e, p, x )
+            use( e.v[1], e, opposite_port(p), x )
+        edgevars[i] = xs
+
+    edge_index = { e: i for i, e in enumerate(net.edges) }
+    chainvars = []
+    for a, path, b in chains:
+        table, back = chain_table( a, path, row, all_costs, bend_cost )
+        (e0, flipped0), (ek, flippedk) = path[0], path[-1]
+        first = { opposite_port(p) if flipped0 else p for p in candidates[edge_index[e0]] }
+        last = { opposite_port(p) if flippedk else p for p in candidates[edge_index[ek]] }
+        ys = dict()
+        for s in sorted(first):
+            for t in sorted(last):
+                if table[s,t]==inf: continue
+                y = ys[s,t] = solver.BoolVar(f'chain_{edge_index[e0]}_{s}_{t}')
+                objective.SetCoefficient( y, table[s,t] + all_costs[row(a,e0),s] + all_costs[row(b,ek),opposite_port(t)] )
+                use( a, e0, s, y )
+                use( b, ek, opposite_port(t), y )
+        # pick exactly one pair of headings for a chain
+        c = solver.Constraint( 1, 1 )
+        for y in ys.values(): c.SetCoefficient( y, 1 )
+        chainvars.append( (ys, back) )
+
     for v in net.nodes.values():
-        costs = cost_matrix(v)
-        for i,e in enumerate(v.edges):
-            my_portvars = [solver.BoolVar(f'pass_{v.name}_{i}_{p}') for p in range(8)]
-            for p in range(8):
-                objective += costs[i,p] * my_portvars[p]
-            # pick exactly one port for an edge
-            solver.Add( solver.Sum(my_portvars)==1 )
-            portvars[(v,e)] = my_portvars
         for p in range(8):
             # assign at most one edge to a port
-            solver.Add( solver.Sum([ portvars[(v,e)][p] for e in v.edges ]) <= 1 )
-
-    # consistent port assignment by identifying opposite sides of the same edge
-    for e in net.edges:
-        for p in range(8):
-            solver.Add( portvars[(e.v[0],e)][p] == portvars[(e.v[1],e)][opposite_port(p)] )
+            xs = [ x for e in v.edges for x in uses.get( (v,e), dict() ).get( p, () ) ]
+            if len(xs)>1:
+                c = solver.Constraint( -infinity, 1 )
+                for x in xs: c.SetCoefficient( x, c.GetCoefficient(x)+1 ) # (a chain may use a port twice)
 
-    # bend penalty
+    # bend penalty, where no chain took care of it
     for v in net.nodes.values():
-        if len(v.edges)==2:
+        if len(v.edges)==2 and v.edges[0] not in in_chain:
             penalty = solver.BoolVar(f'bend_{v.name}')
-            objective += bend_cost*penalty
+            objective.SetCoefficient( penalty, bend_cost )
             e = v.edges[0]
             f = v.edges[1]
-            for p in range(8):
-                solver.Add( penalty >= portvars[(v,e)][p] - portvars[(v,f)][opposite_port(p)])
+            for p, (x,) in uses.get( (v,e), dict() ).items():
+                # penalty >= x - y
+                c = solver.Constraint( 0, infinity )
+                c.SetCoefficient( penalty, 1 )
+                c.SetCoefficient( x, -1 )
+                y = uses.get( (v,f), dict() ).get( opposite_port(p) )
+                if y is not None: c.SetCoefficient( y[0], 1 )
 
-    solver.Minimize(objective)
-    status = solver.Solve()
-    runtime = perf_counter()-start
-    logline( "pa-ilp\tPort assignment ILP runtime (s)\t" + str(runtime) )
-    print( 'Port assignment ILP runtime', runtime, 's' )
-    print( 'Solver status', status )
-    if status==0:
-        net.evict_all_edges()
-        for (v,e), x in portvars.items():
+    objective.SetMinimization()
+    status = config.solve( solver, "assign" )
+    if status not in (lp.Solver.OPTIMAL,lp.Solver.FEASIBLE): return status, None
+    choice = [ max( xs, key=lambda p: xs[p].solution_value() ) if xs is not None else None for xs in edgevars ]
+    for (a, path, b), (ys, back) in zip( chains, chainvars ):
+        s, t = max( ys, key=lambda st: ys[st].solution_value() )
+        for (e, flipped), h in zip( path, chain_headings( back, s, t ) ):
+            choice[edge_index[e]] = opposite_port(h) if flipped else h
+    return status, choice
+
+
+### DEGREE-2 CHAINS ###
+
+# Most stations of a transit network have degree 2, and the bend penalty only couples the
+# two edges at such a node; so a maximal path through degree-2 nodes can be solved exactly
+# by dynamic programming over the 8 headings of its edges. The ILP then only picks the
+# headings of the first and last edge of the chain, at the cost from the DP table.
+# The heading of an edge in a chain is its port at the end towards the start of the chain.
+
+ilp_chains = True # collapse degree-2 chains in assign_by_ilp
+
+def degree2_chains( net ):
+    # Maximal paths whose inner nodes have degree 2, as ( first node, [ (edge, flipped) ],
+    # last node ) where flipped means the edge runs towards the first node. Cycles of
+    # degree-2 nodes only are left out.
+    chains = []
+    seen = set()
+    for a in net.nodes.values():
+        if len(a.edges)==2: continue
+        for e in a.edges:
+            if e in seen: continue
+            v = a
+            path = []
+            while True:
+                path.append( (e, e.v[0]!=v) )
+                seen.add( e )
+                v = e.other(v)
+                if len(v.edges)!=2: break
+                e = v.edges[1] if v.edges[0]==e else v.edges[0]
+            if len(path)>1: chains.append( (a, path, v) )
+    return chains
+
+opposite_ports = np.array( [ opposite_port(p) for p in range(8) ] )
+def chain_table( a, path, row, all_costs, bend_cost ):
+    # table[s,t]: the least cost of the inner nodes of the chain if the first edge has
+    # heading s and the last one heading t; back[i][s,h] is the best heading of edge i
+    # if edge i+1 has heading h
+    table = np.where( np.eye(8,dtype=bool), 0.0, inf )
+    bend = bend_cost*( 1-np.eye(8) )
+    back = []
+    u = a
+    for (e, flipped), (f, _) in zip( path, path[1:] ):
+        u = e.other(u)
+        step = all_costs[row(u,e)][opposite_ports][:,None] + all_costs[row(u,f)][None,:] + bend
+        step[ np.arange(8), opposite_ports ] = inf # both edges at the same port
+        total = table[:,:,None] + step[None,:,:]
+        back.append( total.argmin( axis=1 ) )
+        table = total.min( axis=1 )
+    return table, back
+
+def chain_headings( back, s, t ):
+    # The headings of all edges of a chain from those of its first and last edge
+    headings = [ t ]
+    for b in reversed(back):
+        headings.append( int(b[s,headings[-1]]) )
+    return headings[::-1]
+
+
+### CONSTRAINT PROGRAMMING ###
+
+# The same model as the ILP, for CP-SAT. It searches with several workers at once,
+# starts from the local matching, and hands every better assignment it finds to
+# on_solution( choice, objective ) while it goes on; so a big map need not wait for a
+# proof of optimality, and stop() ends the search with the best assignment so far.
+# The callback runs on a solver thread.
+
+from threading import Lock
+from ortools.sat.python import cp_model
+
+cpsat_scale = 1000 # CP-SAT wants integer costs; this many units per squared radian
+
+cpsat_status = { cp_model.OPTIMAL: lp.Solver.OPTIMAL,
+                 cp_model.FEASIBLE: lp.Solver.FEASIBLE,
+                 cp_model.INFEASIBLE: lp.Solver.INFEASIBLE,
+                 cp_model.MODEL_INVALID: lp.Solver.MODEL_INVALID }
+
+class CpSatSearch:
+    def __init__( self, net, bend_cost=1, config:solvers.SolverConfig = None, locked=() ):
+        self.net = net
+        self.bend_cost = bend_cost
+        self.config = config or solvers.cpsat_config
+        self.locked = locked
+        self.lock = Lock()
+        self.solver = None
+        self.stopped = False
+
+    def stop( self ):
+        # Safe to call from any thread, also before the search has started
+        with self.lock:
+            self.stopped = True
+            if self.solver is not None: self.solver.stop_search()
+
+    def run( self, on_solution=None ):
+        # The best choice found (the port at the first node of every edge), or None
+        net = self.net
+        start = perf_counter()
+        all_costs, ends = cost_matrices(net)
+        hint = net.clone()
+        assign_by_local_matching( hint )
+        hint = [ e.port[0] for e in hint.edges ]
+        candidates = candidate_ports( net, all_costs, ends, ilp_candidates, ilp_candidate_angle, self.locked )
+        status, choice = self.solve( all_costs, ends, candidates, hint, on_solution )
+        if status==cp_model.INFEASIBLE and ilp_candidates<8 and not self.stopped:
+            logline( "stats\tPort assignment CP-SAT infeasible with pruned ports" )
+            candidates = [ set(range(8)) for e in net.edges ]
+            status, choice = self.solve( all_costs, ends, candidates, hint, on_solution )
+        runtime = perf_counter()-start
+        logline( "pa-cpsat\tPort assignment CP-SAT runtime (s)\t" + str(runtime) )
+        logline( "stats\tPort assignment CP-SAT status\t" + str(status) )
+        return choice
+
+    def solve( self, all_costs, ends, candidates, hint, on_solution ):
+        net = self.net
+        model = cp_model.CpModel()
+        objective = []
+        edgevars = []
+        for i, e in enumerate(net.edges):
+            xs = { p: model.new_bool_var(f'edge_{i}_{p}') for p in sorted(candidates[i]) }
+            # pick exactly one port for an edge
+            model.add_exactly_one( xs.values() )
+            for p, x in xs.items():
+                if hint[i] is not None: model.add_hint( x, p==hint[i] )
+            edgevars.append( xs )
+        edge_index = { e: i for i, e in enumerate(net.edges) }
+        def portvar( v, e, p ):
+            i = edge_index[e]
+            return edgevars[i].get( p if e.v[0]==v else opposite_port(p) )
+
+        for n, v in enumerate(net.nodes.values()):
+            for j, e in enumerate(v.edges):
+                for p in range(8):
+                    x = portvar( v, e, p )
+                    if x is not None: objective.append( round(cpsat_scale*all_costs[ends[n]+j,p]) * x )
             for p in range(8):
-                if x[p].solution_value()>0.5:
-                    v.assign(e,p)
+                # assign at most one edge to a port
+                xs = [ x for x in (portvar(v,e,p) for e in v.edges) if x is not None ]
+                if len(xs)>1: model.add_at_most_one( xs )
+
+        # bend penalty
+        bend = round( cpsat_scale*self.bend_cost )
+        for v in net.nodes.values():
+            if len(v.edges)==2:
+                penalty = model.new_bool_var(f'bend_{v.name}')
+                objective.append( bend*penalty )
+                e = v.edges[0]
+                f = v.edges[1]
+                for p in range(8):
+                    x = portvar( v, e, p )
+                    if x is None: continue
+                    # penalty >= x - y
+                    y = portvar( v, f, opposite_port(p) )
+                    model.add( penalty >= x - y if y is not None else penalty >= x )
+
+        model.minimize( sum(objective) )
+        variables = len(model.proto.variables)
+        constraints = len(model.proto.constraints)
+
+        solver = cp_model.CpSolver()
+        config = self.config
+        if config.threads is not None: solver.parameters.num_workers = config.threads
+        if config.time_limit is not None: solver.parameters.max_time_in_seconds = config.time_limit
+        if config.gap is not None: solver.parameters.relative_gap_limit = config.gap
+        if config.parameters:
+            from google.protobuf import text_format
+            text_format.Merge( config.parameters, solver.parameters )
+
+        def read( value ):
+            return [ max( xs, key=lambda p: value(xs[p]) ) for xs in edgevars ]
+        class Incumbents( cp_model.CpSolverSolutionCallback ):
+            def on_solution_callback( self ):
+                if on_solution is not None: on_solution( read(self.boolean_value), self.objective_value/cpsat_scale )
+
+        with self.lock:
+            if self.stopped: return cp_model.UNKNOWN, None
+            self.solver = solver
+        start = perf_counter()
+        status = solver.solve( model, Incumbents() )
+        with self.lock:
+            self.solver = None
+        solvers.record( "assign", 'CP-SAT', variables, constraints, perf_counter()-start, cpsat_status.get(status,lp.Solver.NOT_SOLVED), config.threads )
+        if status not in (cp_model.OPTIMAL,cp_model.FEASIBLE): return status, None
+        return status, read( solver.boolean_value )
+
+def assign_by_cpsat( net, bend_cost=1, config:solvers.SolverConfig = None, on_solution=None, locked=() ):
+    # Blocks until the search ends; for one that can be stopped, use CpSatSearch
+    choice = CpSatSearch( net, bend_cost, config, locked ).run( on_solution )
+    if choice is not None:
+        apply_choice( net, choice )
     else:
-        print( 'Port assignment ILP infeasible' )
-        logline( "stats\tPort assignment ILP infeasible" )
+        logline( "stats\tPort assignment CP-SAT found no solution" )
+    return choice
+
+
+### INCREMENTAL ###
+
+# Global assignment that keeps every port that is set and only chooses ports for the
+# free edge ends. Free ends influence each other through their node (its ports and its
+# bend) and through their edge if both its ends are free; each connected group of those
+# is a region with its own small ILP. A region that was solved before with the same
+# surroundings gets its old answer back without a solve, and the ports that the ends had
+# last time are given to the solver as a hint.
+
+from collections import OrderedDict
+from layout_solver import find, union
+
+# How many solved regions to remember
+incremental_cache_size = 4096
+
+class IncrementalAssigner:
+    def __init__( self ):
+        self.solutions = OrderedDict() # region key -> ports of its free ends
+        self.previous = dict()         # (edge index, end) -> port it got last time
+        self.solved = 0                # regions solved in the last run
+        self.reused = 0                # regions reused in the last run
+
+    def clear( self ):
+        self.solutions.clear()
+        self.previous.clear()
+
+    def assign( self, net, bend_cost=1, config:solvers.SolverConfig = None ):
+        # Assigns the free edge ends; returns how many stayed free (no solution)
+        config = config or solvers.assign_config
+        start = perf_counter()
+        all_costs, ends = cost_matrices(net)
+        edge_index = { e: i for i, e in enumerate(net.edges) }
+        nodes = list( net.nodes.values() )
+        node_index = { v: n for n, v in enumerate(nodes) }
+        parent = list( range(len(nodes)) )
+        for e in net.edges:
+            if e.free_at(e.v[0]) and e.free_at(e.v[1]):
+                union( parent, node_index[e.v[0]], node_index[e.v[1]] )
+        regions = dict()
+        for n, v in enumerate(nodes):
+            if any( e.free_at(v) for e in v.edges ):
+                regions.setdefault( find(parent,n), [] ).append( n )
+
+        self.solved = self.reused = 0
+        unsolved = 0
+        for region in regions.values():
+            # Everything the answer depends on: the ends at these nodes and their costs
+            ends_at = [ (n, j, v, e) for n in region for v in (nodes[n],) for j, e in enumerate(v.edges) ]
+            rows = [ ends[n]+j for n, j, v, e in ends_at ]
+            key = ( bend_cost, config.key(),
+                    tuple( (edge_index[e], e.id(v), e.port_at(v), e.port_at(e.other(v))) for n, j, v, e in ends_at ),
+                    all_costs[rows].tobytes() )
+            ports = self.solutions.get( key )
+            if ports is not None:
+                self.solutions.move_to_end( key )
+                self.reused += 1
+            else:
+                ports = self.solve_region( [ nodes[n] for n in region ], all_costs, ends, node_index, edge_index, bend_cost, config )
+                self.solved += 1
+                self.solutions[key] = ports
+                if len(self.solutions)>incremental_cache_size: self.solutions.popitem( last=False )
+            if ports is None:
+                unsolved += sum( 1 for n, j, v, e in ends_at if e.free_at(v) )
+                continue
+            for (i, end), p in ports.items():
+                e = net.edges[i]
+                e.v[end].assign( e, p )
+                self.previous[(i,end)] = p
+        runtime = perf_counter()-start
+        logline( "pa-inc\tIncremental port assignment runtime (s)\t" + str(runtime) )
+        logline( "stats\tIncremental port assignment regions (total, solved, reused)\t"+str(len(regions))+", "+str(self.solved)+", "+str(self.reused) )
+        if unsolved:
+            logline( "stats\tIncremental port assignment infeasible for edge ends\t"+str(unsolved) )
+        return unsolved
+
+    def solve_region( self, region, all_costs, ends, node_index, edge_index, bend_cost, config ):
+        # (edge index, end) -> port for the free ends at the nodes of the region, or None
+        occupied = { v: { p for p in range(8) if v.ports[p] is not None } for v in region }
+        def allowed( v, e, candidates, straight ):
+            row = ends[node_index[v]] + v.edges.index(e)
+            u = e.other(v)
+            if straight and not e.free_at(u):
+                # as in assign_by_ilp, an edge points the same way from both ends
+                ports = { opposite_port(e.port_at(u)) }
+            elif candidates:
+                ports = set( np.argsort( all_costs[row], kind='stable' )[:ilp_candidates].tolist() )
+                ports |= set( np.flatnonzero( all_costs[row]<=ilp_candidate_angle**2 ).tolist() )
+            else:
+                ports = set( range(8) )
+            return ports - occupied[v]
+        # If an edge with one set end cannot be straight, its free end may bend it, at bend_cost
+        attempts = [ (candidates, True) for candidates in ((True, False) if ilp_candidates<8 else (False,)) ]
+        for candidates, straight in attempts + [ (False, False) ]:
+            result = self.solve_region_with( region, all_costs, ends, node_index, edge_index, bend_cost, config, lambda v, e: allowed(v,e,candidates,straight) )
+            if result is None: continue
+            if not straight:
+                logline( "stats\tIncremental port assignment had to bend edges with one set end" )
+            return result
+        return None
+
+    def solve_region_with( self, region, all_costs, ends, node_index, edge_index, bend_cost, config, allowed ):
+        solver = config.create()
+        infinity = solver.infinity()
+        objective = solver.Objective()
+        endvars = dict() # (node, edge) -> { port: variable }, for the free ends
+        hint = []
+        for v in region:
+            for e in v.edges:
+                if not e.free_at(v) or (v,e) in endvars: continue
+                i = edge_index[e]
+                u = e.other(v)
+                if e.free_at(u):
+                    # both ends free: one variable per direction, at e.v[0]
+                    a, b = e.v
+                    directions = sorted( set(allowed(a,e)) & { opposite_port(p) for p in allowed(b,e) } )
+                    xs = { p: solver.BoolVar(f'edge_{i}_{p}') for p in directions }
+                    endvars[(a,e)] = xs
+                    endvars[(b,e)] = { opposite_port(p): x for p, x in xs.items() }
+                    p = self.previous.get( (i,0) )
+                else:
+                    xs = { p: solver.BoolVar(f'end_{i}_{e.id(v)}_{p}') for p in sorted(allowed(v,e)) }
+                    endvars[(v,e)] = xs
+                    for p, x in xs.items():
+                        # a port that is not opposite the set one bends the edge
+                        if p!=opposite_port(e.port_at(u)): objective.SetCoefficient( x, bend_cost )
+                    p = self.previous.get( (i,e.id(v)) )
+                if not xs: return None
+                # pick exactly one port for an edge end
+                c = solver.Constraint( 1, 1 )
+                for x in xs.values(): c.SetCoefficient( x, 1 )
+                if p in xs: hint.append( xs[p] )
+        def indicator( v, e ):
+            # port -> variable, or port -> None for a set port
+            if (v,e) in endvars: return endvars[(v,e)]
+            return { e.port_at(v): None }
+
+        for v in region:
+            for j, e in enumerate(v.edges):
+                if (v,e) not in endvars: continue
+                for p, x in endvars[(v,e)].items():
+                    objective.SetCoefficient( x, objective.GetCoefficient(x)+all_costs[ends[node_index[v]]+j,p] )
+            for p in range(8):
+                # assign at most one edge to a port (set ports are not allowed to begin with)
+                xs = [ endvars[(v,e)][p] for e in v.edges if p in endvars.get((v,e),()) ]
+                if len(xs)>1:
+                    c = solver.Constraint( -infinity, 1 )
+                    for x in xs: c.SetCoefficient( x, 1 )
+
+        # bend penalty
+        for v in region:
+            if len(v.edges)!=2: continue
+            e, f = v.edges
+            penalty = solver.BoolVar(f'bend_{v.name}')
+            objective.SetCoefficient( penalty, bend_cost )
+            a = indicator( v, e )
+            b = indicator( v, f )
+            for p, x in a.items():
+                # penalty >= x - y, with the set ports moved to the bound
+                q = opposite_port(p)
+                if q in b and b[q] is None: continue # y is 1
+                lo = 1 if x is None else 0
+                c = solver.Constraint( lo, infinity )
+                c.SetCoefficient( penalty, 1 )
+                if x is not None: c.SetCoefficient( x, -1 )
+                if q in b: c.SetCoefficient( b[q], 1 )
+
+        objective.SetMinimization()
+        if hint: solver.SetHint( hint, [1.0]*len(hint) )
+        status = config.solve( solver, "assign" )
+        if status not in (lp.Solver.OPTIMAL,lp.Solver.FEASIBLE): return None
+        ports = dict()
+        for (v,e), xs in endvars.items():
+            ports[(edge_index[e],e.id(v))] = max( xs, key=lambda p: xs[p].solution_value() )
+        return ports
+
+incremental_assigner = IncrementalAssigner()
+
+def assign_incrementally( net, bend_cost=1, config:solvers.SolverConfig = None ):
+    # Global assignment of the free edge ends only; returns how many stayed free
+    return incremental_assigner.assign( net, bend_cost, config )
@@ -0,0 +1,44 @@
+from PySide6.QtCore import QThread, Signal
+
+from assign import CpSatSearch
+
+# Global port assignment by CP-SAT off the GUI thread. Every better assignment it finds
+# is reported as it goes, so the canvas can show it; the designer stops the search when
+# it is good enough, or it ends by itself at the time limit or with the optimum.
+
+class AssignWorker(QThread):
+    incumbent = Signal(object, float) # choice, objective
+    done = Signal(object)             # the worker itself; its choice is the best found
+
+    def __init__(self, net, bend_cost, version=None):
+        super().__init__()
+        self.net = net               # a clone that belongs to the worker from now on
+        self.bend_cost = bend_cost
+        self.version = version       # for the GUI: which state of the network this was made from
+        self.search = CpSatSearch( net, bend_cost )
+        self.choice = None
+
+    def stop( self ):
+        self.search.stop()
+        self.wait()
+
+    def run( self ):
+        self.choice = self.search.run( lambda choice, objective: self.incumbent.emit( choice, objective ) )
+        self.done.emit( self )
+
+
+# A bend cost sweep (see sweep.py) for the preview in the Bend Penalty dialog. Stopping
+# it does not wait: the thread finishes by itself, soon after.
+
+class SweepWorker(QThread):
+    progress = Signal(object) # indices of the bend costs whose designs got better
+
+    def __init__(self, sweep):
+        super().__init__()
+        self.sweep = sweep
+
+    def stop( self ):
+        self.sweep.stop()
+
+    def run( self ):
+        self.sweep.run( lambda indices: self.progress.emit( list(indices) ) )
@@ -0,0 +1,130 @@
+# Compare the layout backends on the Loom examples:
+#   python benchmark_layout.py [repeats]
+# Every example gets ports by local matching (as in the GUI) and is laid out by
+# each backend, without caches; reports the best time and the objective. It also
+# reports how many components the min-cost flow experiment below could solve.
+
+import sys, os
+from math import inf
+from time import perf_counter
+
+from ortools.linear_solver import pywraplp as lp
+from ortools.graph.python import min_cost_flow
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path, NegativeCycleError
+
+import layout
+import solvers
+from fileformat_loom import read_network_from_loom
+from assign import assign_by_local_matching
+from layout_solver import split_components, canonical, solve_payload, is_plain_equality, find, union
+
+backends = ['GLOP','PDLP','CLP','HiGHS']
+# Distances are rounded to multiples of 1/flow_scale for the flow solver
+flow_scale = 1e4
+
+def objective( rows_objective, values ):
+    return sum( coef*values[x] for x, coef in rows_objective[1] )
+
+def benchmark( filename, repeats ):
+    net, _ = read_network_from_loom( filename )
+    net.scale_by_shortest_edge( 80 )
+    assign_by_local_matching( net )
+    payloads = [ canonical( rows, objective )[0] for rows, objective in split_components( *layout.flatten(layout.layout_groups(net)) ) ]
+    flow_fits = sum( solve_flow( *payload ) is not None for payload in payloads )
+    line = f"{os.path.basename(filename):20} {len(net.nodes):5} nodes {sum(len(p[0]) for p in payloads):6} rows {flow_fits}/{len(payloads)} fit flow"
+    for backend in backends:
+        best = None
+        for _ in range(repeats):
+            start = perf_counter()
+            results = [ solve_payload( payload, solvers.SolverConfig(backend) ) for payload in payloads ]
+            elapsed = perf_counter()-start
+            best = elapsed if best is None else min( best, elapsed )
+        if any( result[1] is None for result in results ):
+            line += f" | {backend} {1000*best:8.2f} ms failed"
+        else:
+            value = sum( objective( payload, result[1] ) for payload, result in zip(payloads,results) )
+            line += f" | {backend} {1000*best:8.2f} ms obj {value:10.2f}"
+    print( line )
+
+# A component whose rows all say x_q-x_p>=d (after merging the plain equalities) is a
+# system of difference constraints. The dual of minimising a linear objective over it is
+# a min-cost flow: one arc per row with cost -d, and the objective coefficients as the
+# demands. Complementary slackness then pins the coordinates down: x_q-x_p=d on every
+# arc that carries flow, so the coordinates are longest distances from a root at 0 over
+# the arcs, plus the reversed arcs that carry flow. Diagonal edges and spacers do not
+# fit this mould; solve_flow returns None for those. With ports from local matching no
+# component of the Loom examples fits, so this is not one of the layout backends.
+
+def solve_flow( rows, objective, n ):
+    parent = list( range(n) )
+    for terms, lo, hi in rows:
+        if is_plain_equality( terms, lo, hi ):
+            union( parent, terms[0][0], terms[1][0] )
+    index = dict()
+    for x in range(n):
+        index.setdefault( find(parent,x), len(index) )
+    root = len(index)
+
+    # Arcs p->q with length d for x_q-x_p>=d; every class is >=0, i.e. at least the root
+    tails, heads, lengths = [root]*root, list(range(root)), [0.0]*root
+    for terms, lo, hi in rows:
+        if is_plain_equality( terms, lo, hi ): continue
+        coefs = dict()
+        for x, coef in terms:
+            i = index[find(parent,x)]
+            coefs[i] = coefs.get(i,0) + coef
+        coefs = [ (i,coef) for i,coef in coefs.items() if abs(coef)>1e-9 ]
+        if len(coefs)!=2 or abs(coefs[0][1]+coefs[1][1])>1e-9: return None
+        (q, c), (p, _) = sorted( coefs, key=lambda t: -t[1] )
+        # c*(x_q-x_p) in [lo,hi]
+        if lo>-inf:
+            tails.append( p ); heads.append( q ); lengths.append( lo/c )
+        if hi<inf:
+            tails.append( q ); heads.append( p ); lengths.append( -hi/c )
+
+    demand = np.zeros( root+1, dtype=np.int64 )
+    for x, coef in objective:
+        if abs(coef-round(coef))>1e-9: return None
+        demand[ index[find(parent,x)] ] += round(coef)
+    demand[root] = -demand[:root].sum()
+
+    tails = np.array( tails, dtype=np.int32 )
+    heads = np.array( heads, dtype=np.int32 )
+    lengths = np.array( lengths )
+    # Anything that reaches this capacity is circulating: the rows contradict each other
+    capacity = int( np.abs(demand).sum() ) + 1
+    flow = min_cost_flow.SimpleMinCostFlow()
+    arcs = flow.add_arcs_with_capacity_and_unit_cost( tails, heads, np.full( len(tails), capacity, dtype=np.int64 ), -np.round( lengths*flow_scale ).astype(np.int64) )
+    flow.set_nodes_supplies( np.arange( root+1, dtype=np.int32 ), -demand )
+    if flow.solve()!=flow.OPTIMAL: return None
+    used = flow.flows( arcs )>0
+    if (flow.flows( arcs )>=capacity).any(): return None
+
+    # Longest distances from the root are shortest distances with the lengths negated
+    graph_tails = np.concatenate( (tails, heads[used]) )
+    graph_heads = np.concatenate( (heads, tails[used]) )
+    graph_lengths = np.concatenate( (-lengths, lengths[used]) )
+    # Of parallel arcs only the longest matters (and scipy would add them up)
+    order = np.lexsort( (graph_lengths, graph_heads, graph_tails) )
+    graph_tails, graph_heads, graph_lengths = graph_tails[order], graph_heads[order], graph_lengths[order]
+    first = np.ones( len(order), dtype=bool )
+    first[1:] = (graph_tails[1:]!=graph_tails[:-1]) | (graph_heads[1:]!=graph_heads[:-1])
+    graph = csr_matrix( (graph_lengths[first], (graph_tails[first], graph_heads[first])), shape=(root+1,root+1) )
+    try:
+        distance = shortest_path( graph, method='BF', indices=root )
+    except NegativeCycleError:
+        return None # the rounding picked a flow that is not optimal for the exact lengths
+    if distance[root]!=0 or not np.isfinite(distance).all(): return None
+    coordinates = -distance
+    return lp.Solver.OPTIMAL, [ float(coordinates[index[find(parent,x)]]) for x in range(n) ]
+
+if __name__=='__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv)>1 else 5
+    folder = os.path.join( os.path.dirname(os.path.abspath(__file__)), "loom-examples" )
+    for name in sorted( os.listdir(folder) ):
+        if name.endswith(".json"): benchmark( os.path.join(folder,name), repeats )
+    print( "Mean solver time by model size (variables up to 2^k):" )
+    for (backend, size), (count, seconds) in sorted( solvers.summary("layout").items(), key=lambda t: (t[0][1],t[0][0]) ):
+        print( f"  2^{size:<3} {backend:6} {count:4} solves {1000*seconds:8.2f} ms" )
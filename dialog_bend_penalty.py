@@ -1,4 +1,4 @@
-from PySide6.QtWidgets import QDialog, QHBoxLayout, QSlider, QPushButton, QLabel
+from PySide6.QtWidgets import QDialog, QHBoxLayout, QSlider, QPushButton, QLabel, QCheckBox
 from PySide6.QtCore import Qt
 
 class BendPenaltyDialog(QDialog):
@@ -21,6 +21,10 @@ class BendPenaltyDialog(QDialog):
         self.slider.valueChanged.connect(self.update_label)
         self.layout.addWidget(self.slider)
 
+        # Solve for every value in the background and show the one under the slider
+        self.preview = QCheckBox("Preview")
+        self.layout.addWidget(self.preview)
+
         self.ok_button = QPushButton("OK")
         self.ok_button.clicked.connect(self.accept)
         self.layout.addWidget(self.ok_button)
@@ -31,4 +35,11 @@ class BendPenaltyDialog(QDialog):
         self.label.setText(f"{self.get_value()}")
 
     def get_value(self):
-        return self.slider.value() / 10.0
\ No newline at end of file
+        return self.slider.value() / 10.0
+
+    def get_values(self):
+        # Every value the slider can take, in slider order
+        return [ v / 10.0 for v in range(self.slider.minimum(), self.slider.maximum()+1) ]
+
+    def get_index(self):
+        return self.slider.value() - self.slider.minimum()
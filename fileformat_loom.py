@@ -46,34 +46,43 @@ def add_edge(s,t):
     return e
 
 def export_loom( net, data ):
-    # Put the layout from the Network into Loom's filedata,
-    # so that when we run loom on it, it has our positions and bends.
+    # Loom's filedata with the layout from the Network, as JSON text, so that when we
+    # run loom on it, it has our positions and bends. The data itself is left alone.
     
     scale = 2e-5 # Scale the coordinates to play nice with Loom's assumptions
+    features = []
     for feat in data['features']:
         geom = feat['geometry']
         if geom['type']=="Point":
             prop = feat['properties']
             name = prop['id']
             v = net.nodes[name]
-            geom['coordinates'] = [scale*v.pos.x(), -scale*v.pos.y() ]
+            geom = dict( geom, coordinates=[scale*v.pos.x(), -scale*v.pos.y() ] )
         if geom['type']=="LineString":
             prop = feat['properties']
             s = net.nodes[ prop['from'] ]
             t = net.nodes[ prop['to'] ]
-            geom = feat['geometry']
             bend = []
             for e in s.edges:
                 if e.v[0]==t or e.v[1]==t:
                     if e.bend:
                         bend = [[scale*e.bend.x(),-scale*e.bend.y()]]
                         break
-            geom['coordinates'] = [[scale*s.pos.x(),-scale*s.pos.y()]]+bend+[[scale*t.pos.x(),-scale*t.pos.y()]]
+            geom = dict( geom, coordinates=[[scale*s.pos.x(),-scale*s.pos.y()]]+bend+[[scale*t.pos.x(),-scale*t.pos.y()]] )
+        features.append( dict( feat, geometry=geom ) )
 
-    with open('render.json','w') as fp:
-        json.dump(data,fp)
+    return json.dumps( dict( data, features=features ) )
 
 def render_loom( fname_in, fname_out ):
+    # Start loom | transitmap -l from fname_in to fname_out; returns the processes
     import subprocess
-    cmd = f"cat {fname_in} | loom | transitmap -l > {fname_out}"
-    subprocess.Popen(cmd,shell=True)
\ No newline at end of file
+    with open(fname_in,'rb') as fin, open(fname_out,'wb') as fout:
+        loom = subprocess.Popen(['loom'], stdin=fin, stdout=subprocess.PIPE)
+        try:
+            transitmap = subprocess.Popen(['transitmap','-l'], stdin=loom.stdout, stdout=fout)
+        except OSError:
+            loom.kill()
+            loom.wait()
+            raise
+    loom.stdout.close() # transitmap has it now
+    return [loom, transitmap]
@@ -0,0 +1,170 @@
+# Undo history that keeps what each action changed (ports, positions and bends) rather
+# than a copy of the whole network. The state of a network is three lists in node and
+# edge order: positions, port pairs and bends. Points are never changed in place, so the
+# lists hold the network's own objects. An entry holds the changes from the previous
+# entry, {index: (old, new)} per list, and every so often a full snapshot of the state.
+# Undo and redo walk the changes and write only what they touch.
+#
+# Opening another file puts a new network in the history: its first entry is a snapshot
+# of it, and undoing past that hands back the network from before.
+#
+# Over the memory cap, the oldest entries up to the next snapshot are dropped.
+
+# Store a full snapshot after this many entries of changes
+history_snapshot_interval = 64
+# Limits; the newest snapshot and everything after it are always kept
+history_max_entries = 1000
+history_max_bytes = 32*2**20
+
+class Entry:
+    __slots__ = ('text','net','nodes','delta','snapshot')
+    def __init__(self, text, net, nodes, delta, snapshot):
+        self.text = text
+        self.net = net           # the network this is a state of
+        self.nodes = nodes       # its nodes in order (shared by its entries)
+        self.delta = delta       # changes from the previous entry; None at the first entry of a network
+        self.snapshot = snapshot # the full state, or None
+
+class History:
+    def __init__(self):
+        self.entries = []
+        self.index = -1
+        self.state = None # the state of the current entry
+        self.bytes = 0
+
+    def __len__(self): return len(self.entries)
+    def text(self, i): return self.entries[i].text
+
+    def checkpoint(self, text, net):
+        # Add the network as it is now after the current entry; the future is dropped
+        for entry in self.entries[self.index+1:]: self.bytes -= entry_bytes(entry)
+        del self.entries[self.index+1:]
+        new = capture( net )
+        if self.index<0 or self.entries[self.index].net is not net:
+            entry = Entry( text, net, list(net.nodes.values()), None, copy_state(new) )
+        else:
+            entry = Entry( text, net, self.entries[self.index].nodes, diff( self.state, new ), None )
+            if self.index-self.last_snapshot(self.index)+1>=history_snapshot_interval:
+                entry.snapshot = copy_state( new )
+        self.entries.append( entry )
+        self.bytes += entry_bytes( entry )
+        self.index += 1
+        self.state = new
+        self.compact()
+
+    def amend(self, net):
+        # Make the current entry the network as it is now (e.g. once its layout is done)
+        entry = self.entries[self.index]
+        self.bytes -= entry_bytes( entry )
+        new = capture( net )
+        change = diff( self.state, new )
+        if entry.delta is not None:
+            entry.delta = merge( entry.delta, change )
+        if entry.snapshot is not None:
+            entry.snapshot = copy_state( new )
+        self.bytes += entry_bytes( entry )
+        if self.index+1<len(self.entries) and self.entries[self.index+1].delta is not None:
+            # The next entry now starts from here
+            following = self.entries[self.index+1]
+            self.bytes -= entry_bytes( following )
+            following.delta = merge( tuple( { j: (b,a) for j, (a,b) in part.items() } for part in change ), following.delta )
+            self.bytes += entry_bytes( following )
+        self.state = new
+
+    def revert(self):
+        # Undo changes to the current network that were never checkpointed (e.g. a preview)
+        put( self.entries[self.index], self.state )
+
+    def goto(self, i):
+        # Move to entry i; returns its network, in the state of that entry
+        target = self.entries[i]
+        between = range( min(i,self.index)+1, max(i,self.index)+1 )
+        if len(between)<=history_snapshot_interval and all( self.entries[k].delta is not None for k in between ):
+            # Walk the changes from here
+            touched = [ set(), set(), set() ]
+            step = 1 if i>self.index else -1
+            for k in range( self.index, i, step ):
+                delta = self.entries[k+1].delta if step>0 else self.entries[k].delta
+                for part, changes, keys in zip( self.state, delta, touched ):
+                    for j, (old, new) in changes.items():
+                        part[j] = new if step>0 else old
+                        keys.add( j )
+            put( target, self.state, touched )
+        else:
+            # From the nearest snapshot
+            first = self.last_snapshot( i )
+            self.state = copy_state( self.entries[first].snapshot )
+            for k in range( first+1, i+1 ):
+                for part, changes in zip( self.state, self.entries[k].delta ):
+                    for j, (old, new) in changes.items(): part[j] = new
+            put( target, self.state )
+        self.index = i
+        return target.net
+
+    def last_snapshot(self, i):
+        while self.entries[i].snapshot is None: i -= 1
+        return i
+
+    def compact(self):
+        # Drop the oldest entries, up to the next snapshot, while over the limits
+        while len(self.entries)>history_max_entries or self.bytes>history_max_bytes:
+            cut = next( (k for k in range( 1, self.index+1 ) if self.entries[k].snapshot is not None), None )
+            if cut is None: return
+            for entry in self.entries[:cut]: self.bytes -= entry_bytes(entry)
+            del self.entries[:cut]
+            self.index -= cut
+            self.entries[0].delta = None
+
+def capture( net ):
+    return ( [ v.pos for v in net.nodes.values() ],
+             [ (e.port[0],e.port[1]) for e in net.edges ],
+             [ e.bend for e in net.edges ] )
+
+def copy_state( state ):
+    return tuple( list(part) for part in state )
+
+def diff( old, new ):
+    # {index: (old, new)} for each part of the state; unchanged objects are the same objects
+    return tuple( { j: (a,b) for j, (a,b) in enumerate(zip(old_part,new_part)) if a is not b and a!=b } for old_part, new_part in zip(old,new) )
+
+def merge( first, second ):
+    # The changes of first followed by second
+    merged = []
+    for a, b in zip( first, second ):
+        changes = dict( a )
+        for j, (old, new) in b.items():
+            old = changes[j][0] if j in changes else old
+            if old==new: changes.pop( j, None )
+            else: changes[j] = (old, new)
+        merged.append( changes )
+    return tuple( merged )
+
+def put( entry, state, touched=None ):
+    # Make the network of the entry match the state; only where touched says, if given
+    positions, ports, bends = state
+    nodes = entry.nodes
+    for j in (range(len(positions)) if touched is None else touched[0]):
+        if nodes[j].pos is not positions[j]: nodes[j].pos = positions[j]
+    edges = entry.net.edges
+    changed = [ j for j in (range(len(ports)) if touched is None else touched[1]) if tuple(edges[j].port)!=ports[j] ]
+    # Clear all changed ports first, so that no port is taken while moving edges around
+    for j in changed:
+        e = edges[j]
+        for end in (0,1):
+            if e.port[end] is not None: e.v[end].ports[e.port[end]] = None
+            e.port[end] = None
+    for j in changed:
+        e = edges[j]
+        for end in (0,1):
+            if ports[j][end] is not None:
+                e.port[end] = ports[j][end]
+                e.v[end].ports[ports[j][end]] = e
+    for j in (range(len(bends)) if touched is None else touched[2]):
+        edges[j].bend = bends[j]
+
+def entry_bytes( entry ):
+    # Roughly: a slot per list item, and some for every change
+    size = 100
+    if entry.delta is not None: size += 150*sum( len(changes) for changes in entry.delta )
+    if entry.snapshot is not None: size += 8*sum( len(part) for part in entry.snapshot )
+    return size
@@ -0,0 +1,239 @@
+import os
+import pickle
+import struct
+import zlib
+from glob import glob
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+
+from CompactNetwork import CompactNetwork, no_port
+from history import capture, diff
+from log import timestring
+
+# The session journal: enough of every change to the network to get the design back
+# after a crash. Like the log, nothing is written unless something turns it on (the GUI
+# does), and the session folder is only made on the first record.
+#
+# A session folder holds, for every network that was opened, network-<j>.pkl with its
+# structure and file data; and then snapshot-<k>-<j>.npy with the full state of network j
+# (positions, ports and bends as one float64 array), each followed by journal-<k>.bin
+# with the changes since. A journal record is a frame (length, crc32) around the text of
+# the change and the new values of the positions, ports and bends that it changed; a
+# torn frame at the end (from a crash) is ignored on resume. Every so many records a new
+# snapshot starts a new journal and the older files are deleted.
+#
+# The GUI thread only takes the state of the network (like the undo history does);
+# comparing it with the last one, encoding and writing happen on a thread of their own.
+# Resuming memory-maps the newest snapshot and replays its journal.
+
+enabled = False
+session_prefix = "mooey-session-"
+# Start a new snapshot after this many records
+journal_snapshot_interval = 256
+
+frame = struct.Struct( '<II' ) # payload length, crc32
+
+class Journal:
+    def __init__(self):
+        self.folder = None
+        self.net = None     # the network recorded last
+        self.network = -1   # number of its network file
+        self.queue = Queue()
+        self.thread = None
+
+    def record( self, text, net, filedata=None ):
+        # Note down how the network is now; call after every change worth keeping
+        if not enabled: return
+        if self.thread is None:
+            self.folder = new_folder( session_prefix + timestring() )
+            self.thread = Thread( target=self.write, daemon=True )
+            self.thread.start()
+        if net is not self.net:
+            self.network += 1
+            self.queue.put( ('network', self.network, CompactNetwork.from_network(net), filedata) )
+            self.net = net
+        self.queue.put( ('state', text, capture( net )) )
+
+    def close( self ):
+        # Write out what is queued
+        if self.thread is None: return
+        self.queue.put( None )
+        self.thread.join()
+        self.thread = None
+
+    ### The writer thread ###
+
+    def write( self ):
+        out = None
+        state = None  # the state as last written
+        network = -1  # number of the network it is a state of
+        snapshot = -1 # number of the current snapshot
+        records = 0   # records since that snapshot
+        while True:
+            job = self.queue.get()
+            if job is None: break
+            if job[0]=='network':
+                _, network, compact, filedata = job
+                atomic_write( self.path(f"network-{network}.pkl"), pickle.dumps( (compact,filedata), protocol=pickle.HIGHEST_PROTOCOL ) )
+                state = None
+                continue
+            _, text, new = job
+            if state is None or records>=journal_snapshot_interval:
+                snapshot += 1
+                records = 0
+                name = f"snapshot-{snapshot}-{network}"
+                with open( self.path(name+".tmp"), 'wb' ) as fp:
+                    np.save( fp, state_array(new) )
+                    fp.flush()
+                    os.fsync( fp.fileno() )
+                os.replace( self.path(name+".tmp"), self.path(name+".npy") )
+                if out is not None: out.close()
+                out = open( self.path(f"journal-{snapshot}.bin"), 'ab' )
+                self.prune( snapshot, network )
+            else:
+                delta = diff( state, new )
+                if not any( delta ): continue
+                payload = encode_change( text, delta )
+                out.write( frame.pack( len(payload), zlib.crc32(payload) ) + payload )
+                out.flush()
+                records += 1
+            state = new
+        if out is not None: out.close()
+
+    def path( self, name ):
+        return os.path.join( self.folder, name )
+
+    def prune( self, k, j ):
+        # Only the newest snapshot, its journal and its network are needed from now on
+        for name in os.listdir( self.folder ):
+            kind, numbers = parse_name( name )
+            if kind=='snapshot' and numbers[0]<k: os.remove( self.path(name) )
+            if kind=='journal' and numbers[0]<k: os.remove( self.path(name) )
+            if kind=='network' and numbers[0]<j: os.remove( self.path(name) )
+
+current = Journal()
+
+def record( text, net, filedata=None ):
+    current.record( text, net, filedata )
+
+def close():
+    current.close()
+
+def atomic_write( path, data ):
+    with open( path+".tmp", 'wb' ) as fp:
+        fp.write( data )
+        fp.flush()
+        os.fsync( fp.fileno() )
+    os.replace( path+".tmp", path )
+
+def new_folder( name ):
+    # Make a folder by that name, or with a number after it if that one is taken
+    folder, n = name, 1
+    while True:
+        try:
+            os.makedirs( folder )
+            return folder
+        except FileExistsError:
+            n += 1
+            folder = f"{name}_{n}"
+
+def parse_name( name ):
+    # ("snapshot", (k,j)) for snapshot-k-j.npy and so on; (None, ()) for anything else
+    stem, _, extension = name.partition( '.' )
+    kind, *numbers = stem.split( '-' )
+    if extension not in ('npy','bin','pkl') or not all( n.isdigit() for n in numbers ): return None, ()
+    return kind, tuple( int(n) for n in numbers )
+
+
+### ENCODING ###
+
+# A state is positions (x,y per node), then ports (both ends per edge, NaN for none),
+# then bends (x,y per edge, NaN for none)
+
+def state_array( state ):
+    positions, ports, bends = state
+    nan = np.nan
+    return np.concatenate( (
+        np.array( [ c for p in positions for c in (p.x(),p.y()) ], dtype=np.float64 ),
+        np.array( [ nan if p is None else p for pair in ports for p in pair ], dtype=np.float64 ),
+        np.array( [ c for b in bends for c in ((nan,nan) if b is None else (b.x(),b.y())) ], dtype=np.float64 ) ) )
+
+def encode_change( text, delta ):
+    # text, then for positions, ports and bends: count, indices and new values
+    positions, ports, bends = delta
+    text = text.encode()
+    parts = [ struct.pack( '<I', len(text) ), text ]
+    parts.append( encode_part( positions, lambda p: (p.x(),p.y()), np.float64 ) )
+    parts.append( encode_part( ports, lambda pair: tuple( no_port if p is None else p for p in pair ), np.int8 ) )
+    parts.append( encode_part( bends, lambda b: (np.nan,np.nan) if b is None else (b.x(),b.y()), np.float64 ) )
+    return b''.join( parts )
+
+def encode_part( changes, values, dtype ):
+    index = np.fromiter( changes.keys(), dtype=np.int32, count=len(changes) )
+    data = np.array( [ values(new) for old, new in changes.values() ], dtype=dtype ).reshape( -1, 2 )
+    return struct.pack( '<I', len(changes) ) + index.tobytes() + data.tobytes()
+
+def decode_change( payload ):
+    # text and (positions, ports, bends) as (indices, (count,2) values)
+    n, = struct.unpack_from( '<I', payload, 0 )
+    text = payload[4:4+n].decode()
+    offset = 4+n
+    parts = []
+    for dtype in (np.float64, np.int8, np.float64):
+        count, = struct.unpack_from( '<I', payload, offset )
+        offset += 4
+        index = np.frombuffer( payload, dtype=np.int32, count=count, offset=offset )
+        offset += 4*count
+        data = np.frombuffer( payload, dtype=dtype, count=2*count, offset=offset ).reshape( -1, 2 )
+        offset += data.nbytes
+        parts.append( (index, data) )
+    return text, parts
+
+def read_journal( path ):
+    # The changes in a journal file, up to the first torn or damaged frame
+    if not os.path.exists( path ): return []
+    with open( path, 'rb' ) as fp:
+        data = fp.read()
+    changes = []
+    offset = 0
+    while offset+frame.size<=len(data):
+        length, crc = frame.unpack_from( data, offset )
+        payload = data[offset+frame.size:offset+frame.size+length]
+        if len(payload)<length or zlib.crc32(payload)!=crc: break
+        changes.append( decode_change( payload ) )
+        offset += frame.size+length
+    return changes
+
+
+### RESUME ###
+
+def sessions():
+    # Earlier session folders (not the one being written now), newest last
+    return sorted( f for f in glob( session_prefix+"*" ) if os.path.isdir(f) and f!=current.folder )
+
+def resume( folder ):
+    # (network, file data, number of changes replayed) as the session left it, or None
+    snapshots = [ (parse_name(name)[1], name) for name in os.listdir( folder ) if parse_name(name)[0]=='snapshot' ]
+    if not snapshots: return None
+    (k, j), name = max( snapshots )
+    with open( os.path.join( folder, f"network-{j}.pkl" ), 'rb' ) as fp:
+        compact, filedata = pickle.load( fp )
+    n = len(compact.names)
+    m = len(compact.colors)
+    state = np.load( os.path.join( folder, name ), mmap_mode='r' )
+    compact.pos = np.array( state[:2*n] ).reshape( n, 2 )
+    ports = np.nan_to_num( state[2*n:2*n+2*m], nan=no_port ).astype( np.int8 ).reshape( m, 2 )
+    compact.bend = np.array( state[2*n+2*m:] ).reshape( m, 2 )
+    changes = read_journal( os.path.join( folder, f"journal-{k}.bin" ) )
+    for text, ((pi,pv), (ei,ev), (bi,bv)) in changes:
+        compact.pos[pi] = pv
+        ports[ei] = ev
+        compact.bend[bi] = bv
+    compact.port = ports
+    compact.node_ports[:] = -1
+    for end in (0,1):
+        assigned = np.flatnonzero( ports[:,end]!=no_port )
+        compact.node_ports[ compact.edge_nodes[assigned,end], ports[assigned,end] ] = assigned
+    return compact.to_network(), filedata, len(changes)
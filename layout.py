@@ -1,12 +1,20 @@
-from math import inf, sqrt, pi
+from math import inf, sqrt, pi, nan, isnan
 from time import perf_counter
+from functools import lru_cache
+from collections import OrderedDict, deque
+from hashlib import blake2b
+from threading import Lock
+from array import array
 
 from Network import *
 
-from mui import logline
+from log import logline
 
 from ortools.linear_solver import pywraplp as lp
 
+import solvers
+from layout_solver import split_components, solve_components, solve_presolved, find, union, Interruption
+
 diag = 1/sqrt(2) # notational convenience
 
 # How long must the distance from station to station be?
@@ -17,135 +25,680 @@ min_dist = 100
 bend_short = 0.5
 bend_long = 1
 
-def layout_lp( net, stable_node:Node = None ):
-    
+# How many hops around an edit may move in a local re-layout, and how often to
+# retry with twice as many when the border holds the region too tightly
+local_hops = 3
+local_retries = 2
+
+# Limits for the cache of finished layouts
+layout_cache_entries = 64
+layout_cache_bytes = 64*2**20
+
+# The engine retires rows instead of deleting them (the wrapper cannot delete);
+# rebuild the model once there are more dead rows than live ones.
+max_dead_rows = 1.0
 
+def layout_lp( net, stable_node:Node = None, config:solvers.SolverConfig = None ):
+    # One-shot layout: build the whole LP, split it into independent components,
+    # merge variables that must be equal and solve.
+    # The GUI keeps a LayoutEngine around instead, so that edits only swap the rows that changed.
     start = perf_counter()
-    solver = lp.Solver.CreateSolver('GLOP')
+    config = config or solvers.layout_config
 
-    if stable_node:
-        # Track where the "stable node" was before
-        old_stable_pos = stable_node.pos
+    # Track where the "stable node" was before
+    old_stable_pos = stable_node.pos if stable_node else None
 
-    objective = solver.Sum([])
-    for v in net.nodes.values():
-        v.xvar = solver.NumVar(0,solver.infinity(), v.name+'_x')
-        v.yvar = solver.NumVar(0,solver.infinity(), v.name+'_y')
+    key = fingerprint( net, config )
+    if layout_cache.restore( key, net ):
+        return layout_result( stable_node, old_stable_pos )
+    conflict = find_conflict( net )
+    if conflict:
+        report_conflict( net, conflict )
+        return False
+    status, value = solve_components( split_components( *flatten(layout_groups(net)) ), config )
+    result = realise_layout( net, status, value, start, stable_node, old_stable_pos )
+    if result is not False: layout_cache.put( key, net )
+    return result
 
-    # Layout constraints and length minimization
+def realise_layout( net, status, value, start, stable_node, old_stable_pos ):
+    # Put a solution on the network; value maps a variable to its solution value
     for e in net.edges:
-        # Clear bends
-        e.bend = None
-        # Add direction and distance constraint:
-        # - from any assigned endpoint of the edge
-        # - or don't, if both sides unassigned
-        if e.port[0] is None:
-            if e.port[1] is None:
-                continue # Unconstrained edge
-            else:
-                # Edge is assigned at v1
-                objective += edge_constraint( solver, objective, e.v[1], e.port[1], e.v[0], min_dist )
-        else:
-            if e.port[1] is None:
-                # Edge is assigned at v0
-                objective += edge_constraint( solver, objective, e.v[0], e.port[0], e.v[1], min_dist )
-            else:
-                # Edge is assigned at both ends; could have a bend
-                if e.port[0]==opposite_port(e.port[1]):
-                    # No bend; do arbitrary direction
-                    objective += edge_constraint( solver, objective, e.v[0], e.port[0], e.v[1], min_dist )
-                else:
-                    # Bend
-                    e.bend = Node(0,0,f"bend-{e.v[0].name}-{e.v[1].name}")
-                    e.bend.xvar = solver.NumVar(0,solver.infinity(), v.name+'_x')
-                    e.bend.yvar = solver.NumVar(0,solver.infinity(), v.name+'_y')
-                    objective += edge_constraint( solver, objective, e.v[0], e.port[0], e.bend, min_dist*bend_length( e, 0 ) )
-                    objective += edge_constraint( solver, objective, e.v[1], e.port[1], e.bend, min_dist*bend_length( e, 1 ) )
-
-    # Space the stations on degree 2 paths
-    seen = dict()
-    for v in net.nodes.values():
-        if v in seen: continue
-        if is_straight_deg2(v):
-            seen[id(v)] = True
-            path1 = spacewalk( v.edges[0].other(v), v, seen )
-            path2 = spacewalk( v.edges[1].other(v), v, seen )
-            walk = path1 + [v] + [v for v in reversed(path2)]
-            spacevar = solver.NumVar(0,solver.infinity(),name=f"{v.name}-spacer")
-            objective += spacevar
-            for a, b in zip(walk,walk[1:]):
-                solver.Add( a.xvar-b.xvar <= spacevar )
-                solver.Add( b.xvar-a.xvar <= spacevar )
-                solver.Add( a.yvar-b.yvar <= spacevar )
-                solver.Add( b.yvar-a.yvar <= spacevar )
-
-
-    # Solve the LP
-    solver.Minimize( objective )
-    status = solver.Solve()
+        e.bend = None # clear bends
     if status==lp.Solver.OPTIMAL:
         runtime = perf_counter()-start
         logline( "layout\tLayout LP runtime (s)\t" + str(runtime) )
-        print( "Layout LP runtime",perf_counter()-start,"s")
+        print( "Layout LP runtime",runtime,"s")
         for v in net.nodes.values():
-            v.set_position( v.xvar.solution_value(), v.yvar.solution_value() )
-            del(v.xvar)
-            del(v.yvar)
-        for e in net.edges:
-            if e.bend is not None:
-                # Bend was a Node for solving; reduce it to a point
-                e.bend = QPointF( e.bend.xvar.solution_value(), e.bend.yvar.solution_value() )
-
-        if stable_node is not None: return stable_node.pos - old_stable_pos
-        else: return True
+            v.set_position( value((v.name,0)), value((v.name,1)) )
+        for i, e in enumerate(net.edges):
+            if has_bend(e):
+                # Bend was a pair of variables for solving; reduce it to a point
+                bend = ('bend',i)
+                e.bend = Point( value((bend,0)), value((bend,1)) )
+        return layout_result( stable_node, old_stable_pos )
     else:
         logline( "stats\tlayout failed with status "+str(status))
         print(status)
         print('OPTIMAL', status==lp.Solver.OPTIMAL)
         print('UNBOUNDED', status==lp.Solver.UNBOUNDED)
         print('INFEASIBLE', status==lp.Solver.INFEASIBLE)
-        for v in net.nodes.values():
-            del(v.xvar)
-            del(v.yvar)
-        for e in net.edges:
-            e.bend = None # clear bends
         return False
 
+def layout_result( stable_node, old_stable_pos ):
+    if stable_node is not None: return stable_node.pos - old_stable_pos
+    else: return True
+
+
+### THE MODEL ###
+
+# The LP is described independently of the solver. A variable is a pair (point,axis)
+# where a point is a node name or ('bend',i) for the bend of edge i, and axis 0/1 is x/y;
+# spacer variables are ('spacer',path). A row is (terms,lo,hi) with terms a tuple of
+# (variable,coefficient) pairs. Every edge and every spacer path is a group of rows
+# plus objective terms, which is what the engine swaps in and out.
+
+def eq( *terms ): return (terms, 0, 0)
+def geq( bound, *terms ): return (terms, bound, inf)
+
+def layout_groups( net ):
+    groups = dict()
+    for i, e in enumerate(net.edges):
+        group = edge_group( e, i )
+        if group is not None: groups[('edge',i)] = group
+    for path in spacer_paths(net):
+        names = tuple( v.name for v in path )
+        groups[('spacer',names)] = spacer_group( names )
+    return groups
+
+def flatten( groups ):
+    rows, objective = [], []
+    for group_rows, group_objective in groups.values():
+        rows.extend( group_rows )
+        objective.extend( group_objective )
+    return rows, objective
+
+def edge_group( e, i ):
+    # Add direction and distance constraint:
+    # - from any assigned endpoint of the edge
+    # - or don't, if both sides unassigned
+    a, b = e.v[0].name, e.v[1].name
+    if e.port[0] is None:
+        if e.port[1] is None:
+            return None # Unconstrained edge
+        else:
+            # Edge is assigned at v1
+            return edge_constraint( b, e.port[1], a, min_dist )
+    else:
+        if e.port[1] is None:
+            # Edge is assigned at v0
+            return edge_constraint( a, e.port[0], b, min_dist )
+        else:
+            # Edge is assigned at both ends; could have a bend
+            if not has_bend(e):
+                # No bend; do arbitrary direction
+                return edge_constraint( a, e.port[0], b, min_dist )
+            else:
+                # Bend
+                bend = ('bend',i)
+                rows0, obj0 = edge_constraint( a, e.port[0], bend, min_dist*bend_length( e, 0 ) )
+                rows1, obj1 = edge_constraint( b, e.port[1], bend, min_dist*bend_length( e, 1 ) )
+                return rows0+rows1, obj0+obj1
+
+def has_bend( e ):
+    return e.port[0] is not None and e.port[1] is not None and e.port[0]!=opposite_port(e.port[1])
+
+@lru_cache(maxsize=4096) # only depends on the path, and paths mostly survive an edit
+def spacer_group( names ):
+    # Space the stations on a degree 2 path: minimize the largest step
+    spacevar = ('spacer',names)
+    rows = []
+    for a, b in zip(names,names[1:]):
+        for axis in (0,1):
+            rows.append( geq( 0, (spacevar,1), ((a,axis),-1), ((b,axis),1) ) )
+            rows.append( geq( 0, (spacevar,1), ((b,axis),-1), ((a,axis),1) ) )
+    return tuple(rows), ((spacevar,1),)
 
-def edge_constraint( solver, objective, a, port, b, min_dist ):
+def edge_constraint( a, port, b, min_dist ):
+    # Rows and objective terms that put point b in direction port from point a
+    ax, ay, bx, by = (a,0), (a,1), (b,0), (b,1)
     match port:
         case 0: # W
-            solver.Add( a.yvar == b.yvar )
-            solver.Add( b.xvar <= a.xvar - min_dist )
-            return a.xvar - b.xvar
+            rows = ( eq( (ay,1), (by,-1) ), geq( min_dist, (ax,1), (bx,-1) ) )
+            return rows, ( (ax,1), (bx,-1) )
         case 1: # SW
-            solver.Add( a.xvar+a.yvar == b.xvar+b.yvar )
-            solver.Add( b.xvar <= a.xvar - diag*min_dist )
-            return 2*diag*a.xvar - 2*diag*b.xvar
+            rows = ( eq( (ax,1), (ay,1), (bx,-1), (by,-1) ), geq( diag*min_dist, (ax,1), (bx,-1) ) )
+            return rows, ( (ax,2*diag), (bx,-2*diag) )
         case 2: # S
-            solver.Add( a.xvar == b.xvar )
-            solver.Add( b.yvar >= a.yvar + min_dist )
-            return b.yvar - a.yvar
+            rows = ( eq( (ax,1), (bx,-1) ), geq( min_dist, (by,1), (ay,-1) ) )
+            return rows, ( (by,1), (ay,-1) )
         case 3: # SE
-            solver.Add( a.xvar-a.yvar == b.xvar-b.yvar )
-            solver.Add( b.xvar >= a.xvar + diag*min_dist )
-            return 2*diag*b.xvar - 2*diag*a.xvar
+            rows = ( eq( (ax,1), (ay,-1), (bx,-1), (by,1) ), geq( diag*min_dist, (bx,1), (ax,-1) ) )
+            return rows, ( (bx,2*diag), (ax,-2*diag) )
         case 4: # E
-            solver.Add( a.yvar == b.yvar )
-            solver.Add( b.xvar >= a.xvar + min_dist )
-            return b.xvar - a.xvar
+            rows = ( eq( (ay,1), (by,-1) ), geq( min_dist, (bx,1), (ax,-1) ) )
+            return rows, ( (bx,1), (ax,-1) )
         case 5: # NE
-            solver.Add( a.xvar+a.yvar == b.xvar+b.yvar )
-            solver.Add( b.xvar >= a.xvar + diag*min_dist )
-            return 2*diag*b.xvar - 2*diag*a.xvar
+            rows = ( eq( (ax,1), (ay,1), (bx,-1), (by,-1) ), geq( diag*min_dist, (bx,1), (ax,-1) ) )
+            return rows, ( (bx,2*diag), (ax,-2*diag) )
         case 6: # N
-            solver.Add( a.xvar == b.xvar )
-            solver.Add( b.yvar <= a.yvar - min_dist )
-            return a.yvar - b.yvar
+            rows = ( eq( (ax,1), (bx,-1) ), geq( min_dist, (ay,1), (by,-1) ) )
+            return rows, ( (ay,1), (by,-1) )
         case 7: # NW
-            solver.Add( a.xvar-a.yvar == b.xvar-b.yvar )
-            solver.Add( b.xvar <= a.xvar - diag*min_dist )
-            return 2*diag*a.xvar - 2*diag*b.xvar
+            rows = ( eq( (ax,1), (ay,-1), (bx,-1), (by,1) ), geq( diag*min_dist, (ax,1), (bx,-1) ) )
+            return rows, ( (ax,2*diag), (bx,-2*diag) )
+
+def node_variables( net ):
+    # Every node gets coordinates, also the ones without assigned edges
+    for v in net.nodes.values():
+        yield (v.name,0)
+        yield (v.name,1)
+
+def local_region( net, seeds, hops, margin=None ):
+    if margin is not None:
+        # Everything in the bounding box of the seeds, plus a margin
+        min_x = min( v.pos.x() for v in seeds )-margin
+        max_x = max( v.pos.x() for v in seeds )+margin
+        min_y = min( v.pos.y() for v in seeds )-margin
+        max_y = max( v.pos.y() for v in seeds )+margin
+        return { v for v in net.nodes.values() if min_x<=v.pos.x()<=max_x and min_y<=v.pos.y()<=max_y }
+    region = set(seeds)
+    frontier = set(seeds)
+    for _ in range(hops):
+        frontier = { u for v in frontier for u in v.neighbors() if u not in region }
+        region.update( frontier )
+    return region
+
+def edge_ports( net ):
+    return tuple( (e.port[0],e.port[1]) for e in net.edges )
+
+def network_structure( net ):
+    # Groups refer to nodes by name and to edges by index, so the engine can carry
+    # its model over to a clone (e.g. after undo) as long as this does not change.
+    return tuple(net.nodes), tuple( (e.v[0].name,e.v[1].name) for e in net.edges )
+
+
+### THE ENGINE ###
+
+class LayoutEngine:
+    def __init__(self):
+        self.structure = None
+        self.structure_key = None # digest of the structure, for fingerprint
+        self.config = solvers.layout_config
+        self.solved = None # edge ports at the last successful solve
+        self.conflict = [] # (edge index, end) that made the last solve fail, if known
+        self.built = None  # layout_groups of the network, kept up to date by current_groups
+        self.reset()
+
+    def reset(self):
+        # The model is only solved here if the config says GLOP; other backends get the
+        # components one by one (and their solver specific parameters are not GLOP's).
+        # Keep GLOP's own presolve out of the way so it can restart from the previous basis.
+        glop = self.config if self.config.backend=='GLOP' else self.config.with_backend('GLOP',"")
+        self.solver = glop.create("use_preprocessing: false")
+        self.settings = (self.config.key(),self.config.threads)
+        self.vars = dict()      # variable -> MPVariable
+        self.groups = dict()    # group key -> (content, MPConstraints)
+        self.objective = dict() # variable -> { group key -> coefficient }
+        self.live_rows = 0
+        self.dead_rows = 0
+        self.dirty = None       # keys of groups that may differ from the model; None for all
+
+    def solve( self, net, stable_node:Node = None, config:solvers.SolverConfig = None, interruption:Interruption = None ):
+        # interruption: to stop the solve from another thread; it then fails
+        start = perf_counter()
+        interruption = interruption or Interruption()
+
+        self.check_config( config )
+        self.check_structure( net )
+
+        # Track where the "stable node" was before
+        old_stable_pos = stable_node.pos if stable_node else None
+
+        key = fingerprint( net, self.config, self.structure_key )
+        if layout_cache.restore( key, net ):
+            self.solved = edge_ports(net)
+            self.conflict = []
+            return layout_result( stable_node, old_stable_pos )
+
+        groups = self.current_groups(net)
+        self.conflict = []
+        if self.config.backend!='GLOP':
+            # Don't bother with the LP if the ports contradict each other
+            self.conflict = find_conflict( net )
+            if self.conflict:
+                report_conflict( net, self.conflict )
+                return False
+            # Not GLOP: independent pieces are solved on their own (in parallel, or from cache)
+            status, value = solve_components( split_components( *flatten(groups) ), self.config, interruption )
+        else:
+            # One model for all components, so an edit only swaps the groups it changed
+            # and GLOP restarts from the previous basis
+            self.update( groups )
+            for x in node_variables(net):
+                self.var(x)
+            # Solve the LP
+            status = interruption.solve( self.config, self.solver, "layout" )
+            value = self.value
+            if status!=lp.Solver.OPTIMAL and not interruption.interrupted:
+                # Only now look for the ports to blame, so that a good edit does not pay for it
+                self.conflict = find_conflict( net )
+                if self.conflict:
+                    report_conflict( net, self.conflict )
+                    return False
+        if interruption.interrupted: return False
+        result = realise_layout( net, status, value, start, stable_node, old_stable_pos )
+        if result is not False:
+            self.solved = edge_ports(net)
+            layout_cache.put( key, net )
+        return result
+
+    def solve_local( self, net, node:Node = None, edge:Edge = None, stable_node:Node = None, hops = None, margin = None, config:solvers.SolverConfig = None, interruption:Interruption = None ):
+        # Only re-solve around an edit. The nodes within a few hops of the edited node and edge,
+        # and of every edge that changed since the last solve, may move; the nodes on the border
+        # of that region stay where they are, and so does everything outside.
+        # Falls back to solve() if there is no layout to start from or the region is stuck.
+        start = perf_counter()
+        interruption = interruption or Interruption()
+        self.check_config( config )
+        self.check_structure( net )
+        if self.solved is None:
+            return self.solve( net, stable_node, interruption=interruption )
+
+        groups = self.current_groups(net)
+        seeds = set()
+        if node is not None: seeds.add( node )
+        if edge is not None: seeds.update( edge.v )
+        for e, ports in zip( net.edges, self.solved ):
+            if (e.port[0],e.port[1])!=ports:
+                seeds.update( e.v )
+        hops = local_hops if hops is None else hops
+        region = None
+        for attempt in range( local_retries+1 ):
+            smaller, region = region, local_region( net, seeds, hops, margin )
+            if smaller is not None and len(region)==len(smaller): break # it does not grow any more
+            status, value, local, border = self.solve_region( net, groups, region, interruption )
+            if interruption.interrupted: return False
+            if status==lp.Solver.OPTIMAL: break
+            logline( "stats\tlocal layout failed with status "+str(status)+" for "+str(len(region))+" nodes" )
+            if attempt==0:
+                # Contradicting ports fail everywhere; only retry for a border that is in the way
+                self.conflict = find_conflict( net )
+                if self.conflict:
+                    report_conflict( net, self.conflict )
+                    return False
+            hops, margin = 2*hops, None if margin is None else 2*margin
+        if status!=lp.Solver.OPTIMAL:
+            logline( "stats\tlocal layout failed, falling back to global" )
+            return self.solve( net, stable_node, interruption=interruption )
+
+        runtime = perf_counter()-start
+        logline( "layout\tLocal layout LP runtime (s)\t" + str(runtime) )
+        logline( "stats\tLocal layout nodes\t" + str(len(region)) )
+        for v in region - border:
+            v.set_position( value((v.name,0)), value((v.name,1)) )
+        for e in net.edges:
+            if e.v[0] in region and e.v[1] in region:
+                e.bend = None # clear bends
+        for key in local:
+            if key[0]=='edge' and has_bend(net.edges[key[1]]):
+                bend = ('bend',key[1])
+                net.edges[key[1]].bend = Point( value((bend,0)), value((bend,1)) )
+        self.solved = edge_ports(net)
+        self.conflict = []
+        # The border held still, so there is no shift for the view to make up for
+        return True
+
+    def solve_region( self, net, groups, region, interruption ):
+        # Solve the groups inside the region with the nodes on its border held in place
+        border = { v for v in region if any( u not in region for u in v.neighbors() ) }
+        local = dict()
+        for key, content in groups.items():
+            if key[0]=='edge':
+                e = net.edges[key[1]]
+                if e.v[0] not in region or e.v[1] not in region: continue
+                if e.v[0] in border and e.v[1] in border and not has_bend(e): continue # nothing to solve
+                local[key] = content
+            else:
+                # Keep the parts of the spacer path that are inside the region
+                run = []
+                for name in key[1]+(None,):
+                    if name is not None and net.nodes[name] in region:
+                        run.append( name )
+                    else:
+                        if len(run)>1: local[('spacer',tuple(run))] = spacer_group( tuple(run) )
+                        run = []
+
+        # The region is not pushed against the axes like a global layout, so coordinates are free
+        bounds = dict()
+        for v in region:
+            for axis, p in ((0,v.pos.x()),(1,v.pos.y())):
+                bounds[(v.name,axis)] = (p,p) if v in border else (-inf,inf)
+        for key in local:
+            if key[0]=='edge':
+                bounds[(('bend',key[1]),0)] = (-inf,inf)
+                bounds[(('bend',key[1]),1)] = (-inf,inf)
+        status, value = solve_presolved( *flatten(local), bounds.keys(), bounds, self.config, interruption )
+        return status, value, local, border
+
+    def check_config( self, config ):
+        # A different solver or different settings: start over with a new model
+        config = config or solvers.layout_config
+        if (config.key(),config.threads)!=self.settings:
+            self.config = config
+            self.reset()
+        self.config = config
+
+    def check_structure( self, net ):
+        structure = network_structure(net)
+        if structure != self.structure:
+            self.reset()
+            self.structure = structure
+            self.structure_key = blake2b( repr(structure).encode(), digest_size=16 ).digest()
+            self.solved = None
+            self.built = None
+
+    def current_groups( self, net ):
+        # layout_groups(net), but only the groups around edges whose ports changed since the
+        # last call are made again: the edge groups at their nodes (bend lengths depend on the
+        # free ports there) and the spacer paths through their nodes. The groups come in the
+        # same order as from layout_groups, so the LP is the same. Do not change the result.
+        ports = edge_ports(net)
+        params = (min_dist,bend_short,bend_long)
+        if self.built is None or self.built[0]!=params:
+            self.order = { name: k for k, name in enumerate(net.nodes) }
+            self.incident = { name: [] for name in net.nodes } # node name -> indices of its edges
+            for i, e in enumerate(net.edges):
+                for v in e.v: self.incident[v.name].append( i )
+            groups = layout_groups(net)
+            spacers_at = dict() # node name -> keys of the spacer groups through it
+            starts = dict()     # spacer key -> place of its path in spacer_paths
+            for key in groups:
+                if key[0]=='spacer':
+                    starts[key] = self.path_start( net, key[1] )
+                    for name in key[1]: spacers_at.setdefault( name, set() ).add( key )
+            self.built = (params, ports, groups, spacers_at, starts)
+            self.dirty = None
+            return groups
+        _, old_ports, groups, spacers_at, starts = self.built
+        nodes = { v.name for i, old in enumerate(old_ports) if old!=ports[i] for v in net.edges[i].v }
+        if not nodes:
+            return groups
+        keys = set()
+        # Spacer paths through the nodes go; their nodes may be on new ones
+        seeds = set(nodes)
+        for name in nodes:
+            for key in list( spacers_at.get(name,()) ):
+                del groups[key]
+                del starts[key]
+                keys.add( key )
+                for other in key[1]:
+                    spacers_at[other].discard( key )
+                    seeds.add( other )
+        # New paths are found in node order, as spacer_paths does, so they come out the same
+        seen = set()
+        for v in sorted( (net.nodes[name] for name in seeds), key=lambda v: self.order[v.name] ):
+            if v in seen or not is_straight_deg2(v): continue
+            seen.add(v)
+            path = spacewalk( v.edges[0].other(v), v, seen )[::-1] + [v] + spacewalk( v.edges[1].other(v), v, seen )
+            key = ('spacer',tuple( u.name for u in path ))
+            groups[key] = spacer_group( key[1] )
+            starts[key] = self.path_start( net, key[1] )
+            keys.add( key )
+            for u in path: spacers_at.setdefault( u.name, set() ).add( key )
+        for name in nodes:
+            for i in self.incident[name]:
+                key = ('edge',i)
+                group = edge_group( net.edges[i], i )
+                if group is None: groups.pop( key, None )
+                else: groups[key] = group
+                keys.add( key )
+        groups = dict( sorted( groups.items(), key=lambda item: (0,item[0][1]) if item[0][0]=='edge' else (1,starts[item[0]]) ) )
+        self.built = (params, ports, groups, spacers_at, starts)
+        if self.dirty is not None: self.dirty |= keys
+        return groups
+
+    def path_start( self, net, names ):
+        # spacer_paths finds a path from its first straight node in node order
+        return min( self.order[name] for name in names if is_straight_deg2(net.nodes[name]) )
+
+    def update( self, groups ):
+        # Swap out the groups that changed since the last update
+        keys = self.groups.keys() | groups.keys() if self.dirty is None else self.dirty
+        changed = [ key for key in keys if key in self.groups and groups.get(key)!=self.groups[key][0] ]
+        touched = set()
+        for key in changed:
+            self.retire( key, touched )
+        if self.dead_rows > max_dead_rows*max(self.live_rows,1):
+            # Too much garbage in the model; start over
+            self.reset()
+            touched = set()
+        everything = not self.groups
+        for key in groups:
+            if key not in self.groups and (everything or key in keys):
+                self.install( key, groups[key], touched )
+        self.dirty = set()
+        objective = self.solver.Objective()
+        for x in touched:
+            objective.SetCoefficient( self.vars[x], sum(self.objective[x].values()) )
+        objective.SetMinimization()
+
+    def install( self, key, content, touched ):
+        rows, terms = content
+        constraints = []
+        for row_terms, lo, hi in rows:
+            c = self.solver.Constraint( lo, hi if hi<inf else self.solver.infinity() )
+            for x, coef in row_terms:
+                c.SetCoefficient( self.var(x), coef )
+            constraints.append(c)
+        for x, coef in terms:
+            self.var(x)
+            self.objective[x][key] = self.objective[x].get(key,0) + coef
+            touched.add(x)
+        self.groups[key] = (content, constraints)
+        self.live_rows += len(constraints)
+
+    def retire( self, key, touched ):
+        # Rows cannot be removed from the model, so make them vacuous
+        (rows, terms), constraints = self.groups.pop(key)
+        for c in constraints:
+            c.Clear()
+            c.SetBounds( -self.solver.infinity(), self.solver.infinity() )
+        for x, _ in terms:
+            self.objective[x].pop(key,None)
+            touched.add(x)
+        self.live_rows -= len(constraints)
+        self.dead_rows += len(constraints)
+
+    def var( self, x ):
+        if x not in self.vars:
+            self.vars[x] = self.solver.NumVar( 0, self.solver.infinity(), str(x) )
+            self.objective[x] = dict()
+        return self.vars[x]
+
+    def value( self, x ):
+        return self.vars[x].solution_value()
+
+
+### RESULT CACHE ###
+
+# Flipping a port back and forth, and undo/redo, ask for layouts that were solved before.
+# Those come from here, keyed by a fingerprint of the network, its ports and the parameters.
+
+def fingerprint( net, config, structure_key=None ):
+    # structure_key: the digest of network_structure(net), if known already
+    h = blake2b( digest_size=16 )
+    h.update( structure_key or blake2b( repr(network_structure(net)).encode(), digest_size=16 ).digest() )
+    h.update( bytes( 8 if p is None else p for ports in edge_ports(net) for p in ports ) )
+    h.update( repr( (min_dist,bend_short,bend_long,config.key()) ).encode() )
+    return h.digest()
+
+class LayoutCache:
+    def __init__( self, max_entries, max_bytes ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # fingerprint -> (positions, bends) as flat arrays
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock() # the layout worker and the GUI may both get here
+
+    def restore( self, key, net ):
+        # Put the cached layout on the network, if there is one
+        with self.lock:
+            entry = self.entries.get( key )
+            if entry is None:
+                self.misses += 1
+                return False
+            self.entries.move_to_end( key )
+            self.hits += 1
+        positions, bends = entry
+        for v, x, y in zip( net.nodes.values(), positions[0::2], positions[1::2] ):
+            v.set_position( x, y )
+        for e, x, y in zip( net.edges, bends[0::2], bends[1::2] ):
+            e.bend = None if isnan(x) else Point( x, y )
+        logline( "stats\tLayout from cache (hits, misses)\t"+str(self.hits)+", "+str(self.misses) )
+        return True
+
+    def put( self, key, net ):
+        positions = array( 'd', ( c for v in net.nodes.values() for c in (v.pos.x(),v.pos.y()) ) )
+        bends = array( 'd', ( c for e in net.edges for c in ((nan,nan) if e.bend is None else (e.bend.x(),e.bend.y())) ) )
+        with self.lock:
+            if key in self.entries: self.drop( key )
+            self.entries[key] = (positions, bends)
+            self.bytes += entry_bytes( positions, bends )
+            while self.entries and ( len(self.entries)>self.max_entries or self.bytes>self.max_bytes ):
+                self.drop( next(iter(self.entries)) )
+
+    def drop( self, key ):
+        self.bytes -= entry_bytes( *self.entries.pop(key) )
+
+    def clear( self ):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+def entry_bytes( positions, bends ):
+    return positions.itemsize*len(positions) + bends.itemsize*len(bends)
+
+layout_cache = LayoutCache( layout_cache_entries, layout_cache_bytes )
+
+
+### CONFLICTS ###
+
+# For a fixed assignment, every edge puts one point in a given direction from another.
+# Along each of the axes x, y, x+y and x-y that makes the two points either level or
+# strictly ordered, and there is no layout if such orders close into a cycle. Finding
+# one is a graph search rather than an LP, and the cycle says which ports are to blame.
+# (Not the other way around: an assignment can pass this and still have no layout.)
+
+port_direction = [ (-1,0), (-1,1), (0,1), (1,1), (1,0), (1,-1), (0,-1), (-1,-1) ]
+conflict_axes = [ (1,0), (0,1), (1,1), (1,-1) ]
+
+def find_conflict( net ):
+    # Returns a short list of (edge index, end) whose ports contradict each other, or []
+    directions = [ d for i, e in enumerate(net.edges) for d in edge_directions( e, i ) ]
+    for axis in conflict_axes:
+        conflict = axis_conflict( directions, axis )
+        if conflict: return conflict
+    return []
+
+def edge_directions( e, i ):
+    # (from point, port, to point, (edge index, end)) for the directions that edge_group puts in the LP
+    a, b = e.v[0].name, e.v[1].name
+    if e.port[0] is None:
+        if e.port[1] is None: return ()
+        return ( (b,e.port[1],a,(i,1)), )
+    if not has_bend(e): return ( (a,e.port[0],b,(i,0)), )
+    bend = ('bend',i)
+    return ( (a,e.port[0],bend,(i,0)), (b,e.port[1],bend,(i,1)) )
+
+def axis_conflict( directions, axis ):
+    # Points that are level along the axis are merged; the orders go between the merged classes
+    parent = dict()
+    level = dict() # point -> [(point, reason)] for the level pairs
+    strict = []
+    for p, port, q, reason in directions:
+        parent.setdefault( p, p )
+        parent.setdefault( q, q )
+        dx, dy = port_direction[port]
+        side = dx*axis[0] + dy*axis[1]
+        if side==0:
+            union( parent, p, q )
+            level.setdefault( p, [] ).append( (q,reason) )
+            level.setdefault( q, [] ).append( (p,reason) )
+        elif side>0: strict.append( (p,q,reason) )
+        else: strict.append( (q,p,reason) )
+    arcs = dict() # class -> [(class, p, q, reason)] for p before q
+    for p, q, reason in strict:
+        arcs.setdefault( find(parent,p), [] ).append( (find(parent,q),p,q,reason) )
+    cycle = order_cycle( arcs )
+    if cycle is None: return []
+    # The orders on the cycle, plus whatever makes each one level with the next
+    conflict = []
+    for k, (_, _, q, reason) in enumerate(cycle):
+        conflict.append( reason )
+        conflict.extend( level_path( level, q, cycle[(k+1)%len(cycle)][1] ) )
+    return list( dict.fromkeys(conflict) )
+
+def order_cycle( arcs ):
+    # Depth-first search for an arc back onto the stack; the cycle returned is the
+    # shortest one through that arc
+    state = dict() # class -> 1 while on the stack, 2 when done
+    for root in arcs:
+        if root in state: continue
+        state[root] = 1
+        stack = [ (root,iter(arcs[root])) ]
+        while stack:
+            u, todo = stack[-1]
+            arc = next( todo, None )
+            if arc is None:
+                state[u] = 2
+                stack.pop()
+            elif state.get(arc[0])==1:
+                return [arc] + shortest_arcs( arcs, arc[0], u )
+            elif arc[0] not in state:
+                state[arc[0]] = 1
+                stack.append( (arc[0],iter(arcs.get(arc[0],()))) )
+    return None
+
+def shortest_arcs( arcs, s, t ):
+    back = { s: None }
+    queue = deque([s])
+    while queue and t not in back:
+        u = queue.popleft()
+        for arc in arcs.get( u, () ):
+            if arc[0] not in back:
+                back[arc[0]] = (u,arc)
+                queue.append( arc[0] )
+    path = []
+    while back[t] is not None:
+        t, arc = back[t]
+        path.append( arc )
+    return path[::-1]
+
+def level_path( level, p, q ):
+    # Reasons along a shortest chain of level pairs from p to q
+    back = { p: None }
+    queue = deque([p])
+    while queue and q not in back:
+        u = queue.popleft()
+        for w, reason in level.get( u, () ):
+            if w not in back:
+                back[w] = (u,reason)
+                queue.append( w )
+    path = []
+    while back[q] is not None:
+        q, reason = back[q]
+        path.append( reason )
+    return path
+
+def report_conflict( net, conflict ):
+    name = lambda v: v.label or v.name
+    text = ", ".join( f'"{name(net.edges[i].v[end])}" port {net.edges[i].port[end]} toward "{name(net.edges[i].v[1-end])}"' for i, end in conflict )
+    logline( "layout\tConflicting ports: "+text )
+
+
+### BEND LENGTHS ###
 
 long_bends = { (1,1), (2,1), (3,1)
              , (1,2), (2,2)
@@ -174,20 +727,34 @@ def bend_angle( p, q ):
     return min( (p-q)%8, (q-p)%8 )
 
 
+### SPACER PATHS ###
+
 def is_straight_deg2(v):
-    return len(v.edges)==2 and v.edges[0].port_at(v)==opposite_port(v.edges[1].port_at(v))
+    if len(v.edges)!=2: return False
+    a = v.edges[0].port_at(v)
+    b = v.edges[1].port_at(v)
+    return a is not None and b is not None and a==opposite_port(b)
+
+def spacer_paths( net ):
+    # Maximal paths through straight degree 2 nodes, including the nodes at their ends
+    seen = set()
+    paths = []
+    for v in net.nodes.values():
+        if v in seen or not is_straight_deg2(v): continue
+        seen.add(v)
+        path1 = spacewalk( v.edges[0].other(v), v, seen )
+        path2 = spacewalk( v.edges[1].other(v), v, seen )
+        paths.append( path1[::-1] + [v] + path2 )
+    return paths
 
 def spacewalk( v, prev, seen ):
-    # Find maximal degree 2 path for spacer variable
-    seen[v] = True
-    walk = []
-    if is_straight_deg2(v):
-        # degree 2, straight through, no bends
+    # Walk away from prev until the first node that is not straight through
+    walk = [v]
+    while is_straight_deg2(v):
+        seen.add(v)
         v0 = v.edges[0].other(v)
         v1 = v.edges[1].other(v)
-        next = v0 if v1==prev else v1
-        if not id(next) in seen:
-            walk = spacewalk( next, v, seen )
-    walk.append(v)
+        prev, v = v, v0 if v1==prev else v1
+        if v in seen: break # went around a loop
+        walk.append(v)
     return walk
-        
@@ -0,0 +1,255 @@
+# Solving the layout LP from its rows (see layout.py for how rows are made).
+# Worker processes import this module, so it must not pull in Qt or the GUI.
+
+from math import inf
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+import multiprocessing
+import os
+from threading import Lock
+
+from ortools.linear_solver import pywraplp as lp
+
+import solvers
+from log import logline
+
+# Components with at least this many rows go to the worker processes,
+# if there is more than one of them; smaller ones are quicker to solve here.
+parallel_min_rows = 500
+# How many solved components to remember
+component_cache_size = 256
+# Slack when checking bounds in the presolve (coordinates are in the hundreds and up)
+tolerance = 1e-6
+
+
+### PRESOLVE ###
+
+# Most rows are plain equalities x==y between two variables (W/E edges share y, N/S
+# edges share x, and so on), so long straight lines are long chains of variables that
+# must be equal. Union-find collapses every such class into one LP variable; the other
+# rows are rewritten over the classes, and rows that become identical are merged.
+
+def solve_presolved( rows, objective, variables=(), bounds=dict(), config=None, interruption=None ):
+    # Returns the solver status and a function from variable to its solution value.
+    # Variables are nonnegative unless bounds gives them other (lo,hi) bounds.
+    config = config or solvers.layout_config
+    interruption = interruption or Interruption()
+    parent = dict()
+    for x in variables: parent[x] = x
+    for terms, lo, hi in rows:
+        for x, _ in terms: parent.setdefault( x, x )
+        if is_plain_equality( terms, lo, hi ):
+            union( parent, terms[0][0], terms[1][0] )
+
+    # Number the classes, then rewrite the rows over the classes
+    index = dict()
+    for x in parent:
+        r = find( parent, x )
+        if r not in index: index[r] = len(index)
+    lower = [-inf]*len(index)
+    upper = [inf]*len(index)
+    for x in parent:
+        i = index[find(parent,x)]
+        lo, hi = bounds.get( x, (0,inf) )
+        lower[i] = max( lower[i], lo )
+        upper[i] = min( upper[i], hi )
+    reduced = dict() # terms -> [lo,hi]
+    for terms, lo, hi in rows:
+        if is_plain_equality( terms, lo, hi ): continue
+        coefs = dict()
+        for x, coef in terms:
+            i = index[find(parent,x)]
+            coefs[i] = coefs.get(i,0) + coef
+        terms = tuple( sorted( (i,coef) for i,coef in coefs.items() if abs(coef)>1e-9 ) )
+        if len(terms)==0:
+            if lo>tolerance or hi<-tolerance: return lp.Solver.INFEASIBLE, None
+        elif len(terms)==1:
+            # A bound on a single class
+            i, coef = terms[0]
+            lo, hi = (lo/coef, hi/coef) if coef>0 else (hi/coef, lo/coef)
+            lower[i] = max( lower[i], lo )
+            upper[i] = min( upper[i], hi )
+        elif terms in reduced:
+            row_bounds = reduced[terms]
+            row_bounds[0] = max( row_bounds[0], lo )
+            row_bounds[1] = min( row_bounds[1], hi )
+        else:
+            reduced[terms] = [lo,hi]
+    # Bounds that cross by less than the tolerance (e.g. two fixed points that should
+    # be level) are pinched together rather than handed to GLOP as infeasible
+    for i in range(len(index)):
+        if lower[i]>upper[i]+tolerance: return lp.Solver.INFEASIBLE, None
+        upper[i] = max( upper[i], lower[i] )
+    for row_bounds in reduced.values():
+        if row_bounds[0]>row_bounds[1]+tolerance: return lp.Solver.INFEASIBLE, None
+        row_bounds[1] = max( row_bounds[1], row_bounds[0] )
+    solver = config.create()
+    infinity = solver.infinity()
+    xs = [ solver.NumVar( max(lower[i],-infinity), min(upper[i],infinity), '' ) for i in range(len(index)) ]
+    for terms, (lo, hi) in reduced.items():
+        c = solver.Constraint( max(lo,-infinity), min(hi,infinity) )
+        for i, coef in terms:
+            c.SetCoefficient( xs[i], coef )
+    coefs = dict()
+    for x, coef in objective:
+        i = index[find(parent,x)]
+        coefs[i] = coefs.get(i,0) + coef
+    objective = solver.Objective()
+    for i, coef in coefs.items():
+        objective.SetCoefficient( xs[i], coef )
+    objective.SetMinimization()
+
+    status = interruption.solve( config, solver, "layout" )
+    if status!=lp.Solver.OPTIMAL: return status, None
+    values = [ x.solution_value() for x in xs ]
+    return status, lambda x: values[index[find(parent,x)]]
+
+def is_plain_equality( terms, lo, hi ):
+    return lo==0 and hi==0 and len(terms)==2 and terms[0][1]==-terms[1][1]
+
+def find( parent, x ):
+    while parent[x]!=x:
+        parent[x] = parent[parent[x]] # path halving
+        x = parent[x]
+    return x
+
+def union( parent, x, y ):
+    parent[find(parent,x)] = find(parent,y)
+
+
+### COMPONENTS ###
+
+# Edges without assigned ports contribute no rows, so a partly assigned network falls
+# apart into independent LPs. Each is solved on its own: big ones in worker processes,
+# and ones that are identical to a component solved before come from the cache.
+
+cache = OrderedDict() # canonical component -> (status, values)
+pool = None
+
+def split_components( rows, objective ):
+    # Group the rows (and objective terms) that share variables
+    parent = dict()
+    for terms, _, _ in rows:
+        for x, _ in terms:
+            parent.setdefault( x, x )
+            union( parent, terms[0][0], x )
+    components = dict()
+    for row in rows:
+        r = find( parent, row[0][0][0] )
+        components.setdefault( r, ([],[]) )[0].append( row )
+    for x, coef in objective:
+        if x in parent: components[ find(parent,x) ][1].append( (x,coef) )
+    return list( components.values() )
+
+def solve_components( components, config=None, interruption=None ):
+    # Returns the solver status and a function from variable to its solution value;
+    # variables that are in no component are 0
+    config = config or solvers.layout_config
+    interruption = interruption or Interruption()
+    values = dict()
+    status = lp.Solver.OPTIMAL
+    jobs = []
+    hits = 0
+    for rows, objective in components:
+        payload, variables = canonical( rows, objective )
+        # Backends may pick different optima, so they do not share cache entries
+        key = (config.key(), payload)
+        if key in cache:
+            cache.move_to_end( key )
+            hits += 1
+            jobs.append( (payload, variables, cache[key]) )
+        else:
+            jobs.append( (payload, variables, None) )
+
+    big = [ job for job in jobs if job[2] is None and len(job[0][0])>=parallel_min_rows ]
+    if len(big)>1:
+        futures = { id(job[0]): worker_pool().submit( solve_payload_recorded, job[0], config ) for job in big }
+    else:
+        futures = dict()
+    for payload, variables, result in jobs:
+        if result is None:
+            if id(payload) in futures:
+                result, records = interruption.result( futures[id(payload)] ) or (None, ())
+                for r in records: solvers.record( **r )
+            else:
+                result = solve_payload( payload, config, interruption )
+            if interruption.interrupted:
+                for future in futures.values(): future.cancel()
+                return lp.Solver.NOT_SOLVED, None
+            cache[(config.key(),payload)] = result
+            if len(cache)>component_cache_size: cache.popitem( last=False )
+        component_status, component_values = result
+        if component_status!=lp.Solver.OPTIMAL:
+            status = component_status
+            continue
+        for x, value in zip( variables, component_values ):
+            values[x] = value
+    logline( "stats\tLayout components (solved, from cache, in parallel)\t" + str(len(components)) + "\t" + str(hits) + "\t" + str(len(futures)) )
+    return status, lambda x: values.get( x, 0 )
+
+def canonical( rows, objective ):
+    # Number the variables in order of appearance, so that a component that comes back
+    # unchanged (or an identical one elsewhere) looks the same to the cache
+    index = dict()
+    rows = tuple( ( tuple( (index.setdefault(x,len(index)),coef) for x, coef in terms ), lo, hi ) for terms, lo, hi in rows )
+    objective = tuple( (index[x],coef) for x, coef in objective )
+    return (rows, objective, len(index)), list(index)
+
+def solve_payload( payload, config, interruption=None ):
+    # Runs in a worker process (or here, when it can be interrupted)
+    rows, objective, n = payload
+    status, value = solve_presolved( rows, objective, range(n), config=config, interruption=interruption )
+    if status!=lp.Solver.OPTIMAL: return status, None
+    return status, [ value(i) for i in range(n) ]
+
+def solve_payload_recorded( payload, config ):
+    # Runs in a worker process; hands back the measurements along with the result
+    solvers.drain()
+    result = solve_payload( payload, config )
+    return result, solvers.drain()
+
+def worker_pool():
+    global pool
+    if pool is None:
+        # Spawn rather than fork: the GUI process has threads of its own
+        pool = ProcessPoolExecutor( max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn') )
+    return pool
+
+
+### INTERRUPTION ###
+
+# The layout worker drops a job when a newer one comes in. An Interruption lets it stop
+# the solves of the old job from another thread: the solver that runs in this process is
+# interrupted, and waiting for the worker processes stops. What those are solving cannot
+# be interrupted; it is finished there and thrown away.
+
+class Interruption:
+    def __init__( self ):
+        self.lock = Lock()
+        self.interrupted = False
+        self.solver = None      # the solver running here, if any
+        self.event = Future()   # done when interrupted, for waiting on futures
+
+    def interrupt( self ):
+        # May be called from any thread
+        with self.lock:
+            self.interrupted = True
+            if self.solver is not None: self.solver.InterruptSolve()
+            if not self.event.done(): self.event.set_result( None )
+
+    def solve( self, config, solver, model ):
+        # config.solve, unless interrupted already
+        with self.lock:
+            if self.interrupted: return lp.Solver.NOT_SOLVED
+            self.solver = solver
+        try:
+            return config.solve( solver, model )
+        finally:
+            with self.lock:
+                self.solver = None
+
+    def result( self, future ):
+        # The result of a future, or None if interrupted first
+        wait( (future,self.event), return_when=FIRST_COMPLETED )
+        if self.interrupted: return None
+        return future.result()
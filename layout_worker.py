@@ -0,0 +1,101 @@
+from threading import Condition
+
+from PySide6.QtCore import QThread, Signal
+
+from layout import LayoutEngine
+from layout_solver import Interruption
+from log import logline
+from fileformat_loom import export_loom
+
+# Layout off the GUI thread, so that a slow solve does not freeze panning and hovering.
+# Only the newest job matters: a job that is superseded while it waits is dropped, one
+# that is superseded while it runs is interrupted (see Interruption in layout_solver.py
+# for what can be), and either way its result is never reported. For auto-render, the worker also exports the result for Loom; the
+# GUI hands that to its render manager (see render_worker.py).
+
+class LayoutJob:
+    def __init__(self, net, stable_node=None, local=None, filedata=None, checkpoint=None, version=None):
+        self.net = net               # a clone that belongs to the worker from now on
+        self.stable_node = stable_node # name of the node to keep in place, if any
+        self.local = local           # (node name, edge index) for a local re-layout, if wanted
+        self.filedata = filedata     # Loom data to render into, if wanted
+        self.loom = None             # then: the Loom data with the new layout, as JSON text
+        self.checkpoint = checkpoint # for the GUI: what to call this in the history, if anything
+        self.version = version       # for the GUI: which state of the network this was made from
+        self.generation = None
+        self.result = None
+        self.conflict = []           # (edge index, end) to blame if the layout failed
+        self.error = None            # what went wrong, if the layout raised
+        self.interruption = Interruption()
+
+class LayoutWorker(QThread):
+    done = Signal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.engine = LayoutEngine()
+        self.condition = Condition()
+        self.pending = None
+        self.running = None
+        self.generation = 0
+        self.stopping = False
+
+    def submit( self, job ):
+        with self.condition:
+            self.generation += 1
+            job.generation = self.generation
+            self.pending = job
+            if self.running is not None:
+                self.running.interruption.interrupt()
+            self.condition.notify()
+
+    def stop( self ):
+        with self.condition:
+            self.stopping = True
+            self.pending = None
+            if self.running is not None:
+                self.running.interruption.interrupt()
+            self.condition.notify()
+        self.wait()
+
+    def run( self ):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopping:
+                    self.condition.wait()
+                if self.stopping: return
+                job, self.pending = self.pending, None
+                self.running = job
+
+            try:
+                self.layout( job )
+            except Exception as error:
+                # Report it like a failed layout, and start the next job from a new engine
+                job.result = False
+                job.conflict = []
+                job.loom = None
+                job.error = f"{type(error).__name__}: {error}"
+                logline( "stats\tLayout worker failed\t" + job.error )
+                self.engine = LayoutEngine()
+
+            with self.condition:
+                self.running = None
+            if not self.superseded(job):
+                self.done.emit( job )
+
+    def layout( self, job ):
+        net = job.net
+        stable_node = net.nodes[job.stable_node] if job.stable_node is not None else None
+        if job.local is not None:
+            node, edge = job.local
+            node = net.nodes[node] if node is not None else None
+            edge = net.edges[edge] if edge is not None else None
+            job.result = self.engine.solve_local( net, node, edge, stable_node, interruption=job.interruption )
+        else:
+            job.result = self.engine.solve( net, stable_node, interruption=job.interruption )
+        job.conflict = self.engine.conflict
+        if job.result is not False and job.filedata is not None and not self.superseded(job):
+            job.loom = export_loom( net, job.filedata )
+
+    def superseded( self, job ):
+        return job.generation!=self.generation
@@ -0,0 +1,19 @@
+import datetime
+
+# The session log: what the user did and how long things took. Nothing is written
+# unless something turns it on (the GUI does), and the file is only created on the
+# first line, so scripts and batch jobs that import the core get no log files.
+
+enabled = False
+logfile = None
+
+def timestring():
+    return datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+
+def logline( msg ):
+    global logfile
+    if not enabled: return
+    if logfile is None:
+        logfile = open(f"mooey-log-{timestring()}.txt", "w")
+        print("o hai", file=logfile)
+    print( datetime.datetime.now().strftime('%Y-%m-%d\t%H:%M:%S')+"\t"+msg, file=logfile, flush=True )
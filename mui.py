@@ -1,64 +1,104 @@
 import sys
-from math import inf, pow
-import datetime
+from math import pow
 
-def timestring():
-	return datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-logfile = open(f"mooey-log-{timestring()}.txt", "w")
-print("o hai", file=logfile)
-def logline( msg ):
-	print( f"{datetime.datetime.now().strftime('%Y-%m-%d\t%H:%M:%S')}\t{msg}", file=logfile, flush=True )
+import log
+from log import logline, timestring
+import journal
+log.enabled = True # the GUI keeps a log of the session
+journal.enabled = True # and a journal to resume it from after a crash
 
 from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QSizePolicy, QFrame, QLabel, QCheckBox, QMenu, QMessageBox, QFileDialog, QDialog
-from PySide6.QtGui import QPainter, QPixmap, QColor, Qt, QTransform, QVector2D, QAction, QKeySequence
-from PySide6.QtCore import QPointF, QEvent
+from PySide6.QtGui import QPainter, QColor, Qt, QTransform, QVector2D, QAction, QKeySequence
+from PySide6.QtCore import QPointF, QRectF, QEvent, QTimer
 
 import render
 import ui
 
 from Network import opposite_port
 
-from assign import assign_by_rounding, assign_by_local_matching, assign_by_ilp
-from layout import layout_lp
+from assign import assign_by_rounding, assign_by_local_matching, assign_by_ilp, assign_incrementally, apply_choice
+from layout_worker import LayoutWorker, LayoutJob
+from assign_worker import AssignWorker, SweepWorker
+from render_worker import RenderManager
+from sweep import BendSweep
 
 from fileformat_graphml import read_network_from_graphml
-from fileformat_loom import read_network_from_loom, export_loom, render_loom
+from fileformat_loom import read_network_from_loom, export_loom
 
 from dialog_bend_penalty import BendPenaltyDialog
+from history import History
+from spatial import NodeIndex
+from tiles import TileCache
 
 min_edge_scale = 80
+# Draw the tiles anew once a pan or zoom has been still for this long
+gesture_settle_ms = 150
 
 class Canvas(QWidget):
 	def __init__(self):
 		super().__init__()
-		self.pixmap = QPixmap( self.size() )
-		self.pixmap.fill( QColor('white') )
 		self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
 		self.setMouseTracking(True)
 		self.grabGesture(Qt.PinchGesture)
 
 		# history buffer
-		self.history = []
-		self.history_index = -1
+		self.history = History()
+		# whether the network has changes that are in no checkpoint (previews, search incumbents)
+		self.uncommitted = False
 		
 		# UI state
 		self.old_mouse = None
 		self.view = QTransform()
 
+		# solves layouts in the background (and keeps the layout LP alive between edits)
+		self.layout_worker = LayoutWorker()
+		self.layout_worker.done.connect(self.layout_done)
+		self.layout_worker.start()
+		# runs Loom in the background
+		self.render_manager = RenderManager()
+		self.render_manager.done.connect(self.render_done)
+		# which state of the network a layout job was made from
+		self.network_version = 0
+		# the running global port assignment search, if any
+		self.assign_worker = None
+		# the bend cost sweep behind the Bend Penalty dialog's preview, if any
+		self.sweep_worker = None
+		self.sweep_index = None
+		# stopped sweeps that have not finished yet
+		self.stopped_sweeps = set()
+		# spatial index of the node positions; None when nodes may have moved since
+		self.node_index = None
+		# the edge curves, kept between repaints
+		self.drawing = render.Drawing()
+		# the drawing as tiles of pixels; while panning or zooming, no new ones are drawn
+		# until the view is still for a moment
+		self.tiles = TileCache()
+		self.gesture = False
+		self.settle = QTimer()
+		self.settle.setSingleShot(True)
+		self.settle.setInterval(gesture_settle_ms)
+		self.settle.timeout.connect(self.gesture_done)
+
 		# load a network
 		filename = 'loom-examples/wien.json'
 		self.network, self.filedata = read_network_from_loom(filename)
 		self.network.scale_by_shortest_edge( min_edge_scale )
 
 
+	def nodes(self):
+		# The spatial index of the nodes, rebuilt if they may have moved
+		if self.node_index is None:
+			self.node_index = NodeIndex(self.network)
+		return self.node_index
+
+	def network_changed(self):
+		# Call when nodes or edges may have changed: what is kept for hovering and drawing is rebuilt
+		self.node_index = None
+		self.drawing.stale = True
+		self.tiles.clear()
+
 	def zoom_to_network(self):
-		min_x, min_y = inf, inf
-		max_x, max_y = -inf, -inf
-		for name, v in self.network.nodes.items():
-			min_x = min(min_x, v.pos.x())
-			min_y = min(min_y, v.pos.y())
-			max_x = max(max_x, v.pos.x())
-			max_y = max(max_y, v.pos.y())
+		min_x, min_y, max_x, max_y = self.nodes().bounds()
 		x_scale = (0.9*self.width()) / (max_x - min_x)
 		y_scale = (0.9*self.height()) / (max_y - min_y)
 		scale = min(x_scale, y_scale)
@@ -71,29 +111,29 @@ class Canvas(QWidget):
 		return self.view.inverted()[0].map(QPointF(pos))
 	
 
-	def resizeEvent(self, event):
-		if self.size() != self.pixmap.size():
-			new_pixmap = QPixmap(self.size())
-			new_pixmap.fill(QColor('white'))
-			painter = QPainter(new_pixmap)
-			self.render()
-			painter.drawPixmap(0, 0, self.pixmap)
-			self.pixmap = new_pixmap
-
 	def paintEvent(self, event):
 		painter = QPainter(self)
-		painter.drawPixmap(0, 0, self.pixmap)
-
-	def render(self):
-		#self.network.clone()
-		painter = QPainter(self.pixmap)
+		painter.fillRect(self.rect(), QColor('white'))
+		ui.update_params( self.view.m11() ) # element [1,1] of the view matrix is scale in our case
+		show_labels = self.show_labels.isChecked()
+		draw = lambda tile_painter, rect: render.render_network(tile_painter, self.network, show_labels, self.drawing, rect, self.nodes())
+		self.tiles.paint(painter, self.view, self.size(), draw, show_labels, self.gesture)
+		# UI for the mouse on top
 		painter.setRenderHint(QPainter.Antialiasing)
-		# viewport
 		painter.setTransform(self.view)
-		# draw
-		self.pixmap.fill( QColor('white') )
-		ui.update_params( self.view.m11() ) # element [1,1] of the view matrix is scale in our case
-		render.render_network(painter, self.network, self.show_labels.isChecked() )
+		render.render_overlay(painter, self.network)
+
+	def render(self):
+		# Paint soon; the drawing itself comes from the tiles
+		self.update()
+
+	def gesture_step(self):
+		# The view is moving: show what the tiles have until it stops
+		self.gesture = True
+		self.settle.start()
+
+	def gesture_done(self):
+		self.gesture = False
 		self.update()
 
 	def mousePressEvent(self, event): self.handle_mouse(event,press=True)
@@ -110,12 +150,7 @@ class Canvas(QWidget):
 		ui.hover_node = None
 		ui.hover_edge = None
 		ui.hover_empty_port = None
-		closest_dist = ui.hover_node_radius
-		for v in self.network.nodes.values():
-			dist = QVector2D(v.pos - pos).length()
-			if dist < closest_dist:
-				closest_dist = dist
-				ui.hover_node = v
+		ui.hover_node = self.nodes().nearest(pos.x(), pos.y(), ui.hover_node_radius)
 		if ui.hover_node:
 			closest_dist = ui.handle_radius
 			# consider the rose
@@ -140,6 +175,8 @@ class Canvas(QWidget):
 
 		# for undo message: what did we change about the network, if anything?
 		network_change = None
+		# and which edge, for a local re-layout
+		changed_edge = None
 
 		### recognize which actions, if any, to trigger based on this mouse event
 
@@ -148,6 +185,7 @@ class Canvas(QWidget):
 			# drag view
 			drag = (event.position() - self.old_mouse) / self.view.m11() # account for view scale
 			self.view.translate( drag.x(), drag.y() )
+			self.gesture_step()
 
 		if event.buttons() == Qt.RightButton:
 			if ui.hover_edge:
@@ -162,11 +200,13 @@ class Canvas(QWidget):
 						assert ui.hover_node is not None
 						assert ui.hover_edge is not None
 						ui.hover_node.try_evict(ui.hover_edge)
+						changed_edge = ui.hover_edge
 						network_change = f'Evict at "{ui.hover_node.label}" toward "{ui.hover_edge.other(ui.hover_node.name).label}"'
 					if action == straighten:
 						assert ui.hover_node is not None
 						assert ui.hover_edge is not None
 						ui.hover_node.straighten_deg2(ui.hover_edge)
+						changed_edge = ui.hover_edge
 						network_change = f'Straighten from "{ui.hover_node.label}" toward "{ui.hover_edge.other(ui.hover_node).label}" (context menu)'
 			elif ui.hover_node is not None and ui.hover_empty_port is None:
 				if ui.hover_node.is_right_angle():
@@ -230,6 +270,7 @@ class Canvas(QWidget):
 						ui.selected_node.assign( ui.selected_edge, ui.hover_empty_port, force=True)
 					else:
 						ui.selected_node.assign_both_ends( ui.selected_edge, ui.hover_empty_port, force=True )
+					changed_edge = ui.selected_edge
 					network_change = f'Reassign at "{ui.selected_node.label}" - "{ui.selected_edge.other(ui.hover_node).label}" to port {ui.hover_empty_port}'
 				# we did a thing; don't have a selection anymore
 				ui.selected_node = None
@@ -239,36 +280,172 @@ class Canvas(QWidget):
 		if doubleclick and event.buttons() == Qt.LeftButton:
 			if ui.hover_edge is not None:
 				ui.hover_node.straighten_deg2( ui.hover_edge )
+				changed_edge = ui.hover_edge
 				network_change = f'Straighten from "{ui.hover_node.label}" toward "{ui.hover_edge.other(ui.hover_node).label}" (double click)'
 
 
 		### Did we do anything? Then solve and render as appropriate, and to undo buffer
 		
 		if network_change is not None:
-			if self.auto_update.isChecked():
-				resolve_shift = layout_lp(self.network,ui.hover_node)
-				if resolve_shift:
-					self.view.translate(-resolve_shift.x(), -resolve_shift.y())
-					if self.auto_render.isChecked():
-						export_loom(self.network,self.filedata)
-						render_loom( "render.json", "render.svg" )
-				elif resolve_shift is False:
-					m = QMessageBox()
-					m.setText("Failed to realise layout.")
-					m.setIcon(QMessageBox.Warning)
-					m.setStandardButtons(QMessageBox.Ok)
-					m.exec()
 			self.history_checkpoint( network_change )
+			if self.auto_update.isChecked():
+				self.request_layout( ui.hover_node, self.local_update.isChecked(), changed_edge )
 
 		### Remember mouse position for next time and redraw.
 
 		self.old_mouse = event.position()
 		self.render()    
 
+	def request_layout(self, stable_node=None, local=False, changed_edge=None, checkpoint=None):
+		# Hand a layout to the worker; layout_done picks it up from there.
+		# Without a checkpoint text, the result goes into the current history entry.
+		stable_name = stable_node.name if stable_node is not None else None
+		if local:
+			local = ( stable_name, self.network.edges.index(changed_edge) if changed_edge is not None else None )
+		else:
+			local = None
+		job = LayoutJob( self.network.clone(),
+			stable_node = stable_name,
+			local = local,
+			filedata = self.filedata if self.auto_render.isChecked() and self.filedata is not None else None,
+			checkpoint = checkpoint,
+			version = self.network_version )
+		self.solving_label.setText("Solving…")
+		self.layout_worker.submit(job)
+
+	def layout_done(self, job):
+		if job.generation==self.layout_worker.generation:
+			self.solving_label.setText("")
+		if job.version!=self.network_version:
+			return # the network changed in the meantime (e.g. undo)
+		ui.conflict = dict()
+		for i, end in job.conflict:
+			ui.conflict.setdefault( self.network.edges[i], [] ).append( end )
+		self.tiles.clear() # the conflicts are in the drawing
+		if job.result is False:
+			logline( "user\t"+"Failed to realize layout.")
+			m = QMessageBox()
+			if ui.conflict: m.setText("Failed to realise layout: the ports marked in red contradict each other.")
+			elif job.error is not None: m.setText(f"Failed to realise layout: {job.error}")
+			else: m.setText("Failed to realise layout.")
+			m.setIcon(QMessageBox.Warning)
+			m.setStandardButtons(QMessageBox.Ok)
+			m.exec()
+		else:
+			# copy the layout from the worker's clone
+			for name, v in job.net.nodes.items():
+				self.network.nodes[name].pos = v.pos
+			for e, job_e in zip(self.network.edges, job.net.edges):
+				e.bend = job_e.bend
+			self.network_changed()
+			if job.result is not True:
+				self.view.translate(-job.result.x(), -job.result.y())
+		if job.loom is not None:
+			self.start_render( job.loom, "render.svg" )
+		if job.checkpoint is not None:
+			self.history_checkpoint( job.checkpoint )
+			if drawing_is_completely_oob(self):
+				self.zoom_to_network()
+		else:
+			self.history_amend()
+		self.render()
+
+	def start_render(self, data, output):
+		# Loom in the background; render_done reports back
+		self.render_manager.submit( data, output )
+		self.render_label.setText("Rendering…")
+
+	def render_done(self, job):
+		if job.error is not None:
+			logline( "user\t"+f"Render to {job.output} failed: {job.error}" )
+			self.render_label.setText("Render failed")
+		elif not self.render_manager.busy():
+			self.render_label.setText(f"Rendered {job.output}")
+
+	def start_assign_search(self, bend_cost):
+		# CP-SAT in the background; assign_incumbent shows its progress
+		self.stop_assign_search()
+		worker = AssignWorker( self.network.clone(), bend_cost, self.network_version )
+		worker.incumbent.connect(self.assign_incumbent)
+		worker.done.connect(self.assign_done)
+		self.assign_worker = worker
+		self.assign_label.setText("Searching…")
+		self.assign_stop_button.setEnabled(True)
+		worker.start()
+
+	def stop_assign_search(self):
+		# The search ends with the best assignment so far (see assign_done)
+		if self.assign_worker is not None:
+			self.assign_worker.stop()
+
+	def assign_incumbent(self, choice, objective):
+		worker = self.assign_worker
+		if worker is None or self.sender()!=worker: return
+		if worker.version!=self.network_version:
+			worker.search.stop() # the network changed in the meantime; this is of no use now
+			return
+		apply_choice( self.network, choice )
+		self.uncommitted = True
+		self.network_changed()
+		self.assign_label.setText(f"Best so far: {objective:.3f}")
+		self.render()
+
+	def assign_done(self, worker):
+		if worker!=self.assign_worker: return
+		self.assign_worker = None
+		self.assign_label.setText("")
+		self.assign_stop_button.setEnabled(False)
+		if worker.version!=self.network_version: return
+		if worker.choice is None:
+			logline( "user\t"+"Global port assignment found no solution." )
+			return
+		apply_choice( self.network, worker.choice )
+		self.history_checkpoint(f"Assign ports globally with CP-SAT (bend cost {worker.bend_cost})")
+		if self.auto_update.isChecked():
+			self.request_layout()
+		self.render()
+
+	def start_bend_sweep(self, bend_costs):
+		# Designs for all bend costs in the background; show_bend_sweep picks one
+		self.stop_bend_sweep()
+		self.sweep_worker = SweepWorker( BendSweep( self.network, bend_costs ) )
+		self.sweep_worker.progress.connect(self.bend_sweep_progress)
+		self.sweep_worker.start()
+
+	def stop_bend_sweep(self):
+		# Returns the sweep, with whatever it had found; its thread finishes by itself
+		worker, self.sweep_worker = self.sweep_worker, None
+		if worker is None: return None
+		worker.progress.disconnect(self.bend_sweep_progress)
+		worker.stop()
+		self.stopped_sweeps.add(worker)
+		worker.finished.connect(lambda: self.stopped_sweeps.discard(worker))
+		if worker.isFinished(): self.stopped_sweeps.discard(worker)
+		return worker.sweep
+
+	def wait_for_sweeps(self):
+		# On quit: a thread must not outlive its QThread
+		self.stop_bend_sweep()
+		for worker in list(self.stopped_sweeps):
+			worker.wait()
+
+	def bend_sweep_progress(self, indices):
+		if self.sender()==self.sweep_worker and self.sweep_index in indices:
+			self.show_bend_sweep(self.sweep_index)
+
+	def show_bend_sweep(self, index):
+		# Put the design for the index-th bend cost on the canvas, as far as it is known
+		self.sweep_index = index
+		if self.sweep_worker is not None and self.sweep_worker.sweep.apply(index, self.network):
+			self.uncommitted = True
+			self.network_changed()
+			self.render()
+
 	def handle_scale_at(self, mouse_pos, scale):
 		pos = self.worldspace(mouse_pos)
 		scaleAt = QTransform( scale,0, 0,scale, (1-scale)*pos.x(), (1-scale)*pos.y() )
 		self.view = scaleAt * self.view
+		self.gesture_step()
 
 	def wheelEvent(self, event):
 		if event.pixelDelta().manhattanLength() > 0 and event.source()==Qt.MouseEventSource.MouseEventSynthesizedBySystem:
@@ -281,6 +458,7 @@ class Canvas(QWidget):
 				# Actually pan
 				drag = event.pixelDelta() / self.view.m11() # m11 accounts for view scale
 				self.view.translate( drag.x(), drag.y() )
+				self.gesture_step()
 		elif event.angleDelta().y() != 0 and event.source()==Qt.MouseEventSource.MouseEventNotSynthesized:
 			# Actual mouse wheel zoom
 			s = pow( 1.2, event.angleDelta().y()/120 )
@@ -315,57 +493,82 @@ class Canvas(QWidget):
 			self.history_checkpoint( f'Open "{file_name}"' )
 			self.zoom_to_network()
 
-	
+
+	def resume_session(self):
+		# The design as the last session (e.g. one that crashed) left it
+		folders = journal.sessions()
+		resumed = journal.resume(folders[-1]) if folders else None
+		if resumed is None:
+			m = QMessageBox()
+			m.setText("There is no earlier session to resume.")
+			m.setIcon(QMessageBox.Warning)
+			m.setStandardButtons(QMessageBox.Ok)
+			m.exec()
+			return
+		self.network, self.filedata, _ = resumed
+		self.history_checkpoint( f'Resume "{folders[-1]}"' )
+		self.zoom_to_network()
+		self.render()
+
 	def history_checkpoint(self, text):
 		# Log the message
 		logline( "user\t"+text )
-		# Delete the future
-		self.history = self.history[0:self.history_index+1]
-		# Add the present
-		self.history.append(( text, self.network.clone() ))
-		self.history_index += 1
+		# Delete the future and add the present
+		self.history.checkpoint( text, self.network )
+		journal.record( text, self.network, self.filedata )
+		self.uncommitted = False
+		self.network_version += 1
+		self.network_changed()
 		self.update_history_actions()
 
+	def history_amend(self):
+		# Put the current network in the current history entry (e.g. once its layout is done)
+		self.history.amend( self.network )
+		journal.record( self.history.text(self.history.index), self.network, self.filedata )
+
 	def update_history_actions(self):
 		# Set the text and availability of the "undo" menu item based on where we are in time now.
-		if self.history_index<1:
+		if self.history.index<1:
 			self.undo_action.setEnabled(False)
 			self.undo_action.setText("Undo")
 		else:
 			self.undo_action.setEnabled(True)
-			self.undo_action.setText( "Undo " + self.history[self.history_index][0] )
+			self.undo_action.setText( "Undo " + self.history.text(self.history.index) )
 
-		if self.history_index==len(self.history)-1:
+		if self.history.index==len(self.history)-1:
 			self.redo_action.setEnabled(False)
 			self.redo_action.setText("Redo")
 		else:
 			self.redo_action.setEnabled(True)
-			self.redo_action.setText( "Redo " + self.history[self.history_index+1][0] )
+			self.redo_action.setText( "Redo " + self.history.text(self.history.index+1) )
 
 	def undo(self):
 		# Assumes we don't undo to before the start of time
 		logline("user\t"+"Undo")
-		self.history_index -= 1
-		self.fetch_history()
+		self.fetch_history( self.history.index-1 )
 		self.update_history_actions()
 		self.render()
 	def redo(self):
 		# Assumes the future exists
 		logline("user\t"+"Redo")
-		self.history_index += 1
-		self.fetch_history()
+		self.fetch_history( self.history.index+1 )
 		self.update_history_actions()
 		self.render()
-	def fetch_history(self):
-		self.network = self.history[self.history_index][1].clone()
+	def fetch_history(self, index=None):
+		# Go to that history entry, or back to the current one
+		if self.uncommitted:
+			self.history.revert()
+			self.uncommitted = False
+		if index is not None:
+			self.network = self.history.goto( index )
+		journal.record( self.history.text(self.history.index), self.network, self.filedata )
+		self.network_version += 1
+		self.network_changed()
 
 def drawing_is_completely_oob(canvas):
 	# Is any node on the canvas based on the viewport? (Ignores edges.)
-	rect = canvas.rect()
-	for v in canvas.network.nodes.values():
-		p = canvas.view.map(v.pos).toPoint()
-		if rect.contains(p): return False
-	return True
+	rect = canvas.view.inverted()[0].mapRect(QRectF(canvas.rect()))
+	return not canvas.nodes().any_in_rect(rect.left(), rect.top(), rect.right(), rect.bottom())
 
 
 class MainWindow(QMainWindow):
@@ -387,6 +590,12 @@ class MainWindow(QMainWindow):
 		self.canvas.history_checkpoint( "Initial drawing" )
 		self.canvas.update_history_actions()
 
+		QApplication.instance().aboutToQuit.connect(self.canvas.layout_worker.stop)
+		QApplication.instance().aboutToQuit.connect(self.canvas.stop_assign_search)
+		QApplication.instance().aboutToQuit.connect(self.canvas.wait_for_sweeps)
+		QApplication.instance().aboutToQuit.connect(self.canvas.render_manager.stop)
+		QApplication.instance().aboutToQuit.connect(journal.close)
+
 def construct_menubar(window):
 	menu_bar = window.menuBar()
 	# File menu
@@ -395,6 +604,9 @@ def construct_menubar(window):
 	open_action.setShortcut(QKeySequence('Ctrl+O'))
 	open_action.triggered.connect(window.canvas.open_dialog)
 	file_menu.addAction(open_action)
+	resume_action = QAction("Resume last session", window)
+	resume_action.triggered.connect(window.canvas.resume_session)
+	file_menu.addAction(resume_action)
 	exit_action = QAction("Exit", window)
 	exit_action.setShortcut(QKeySequence('Ctrl+Q'))
 	file_menu.addAction(exit_action)
@@ -422,48 +634,67 @@ def do_assign_reset(window):
 
 def do_assign_round(window):
 	assign_by_rounding(window.canvas.network)
-	update_layout_if_auto(window)
 	window.canvas.history_checkpoint("Assign ports by rounding")
+	update_layout_if_auto(window)
 	window.canvas.render()
 
 def do_assign_matching(window):
 	assign_by_local_matching(window.canvas.network)
-	update_layout_if_auto(window)
 	window.canvas.history_checkpoint("Assign ports by matching")
+	update_layout_if_auto(window)
 	window.canvas.render()
 
 def do_assign_ilp(window):
 	bend_cost = 1
+	canvas = window.canvas
+	dialog = BendPenaltyDialog()
+	dialog.preview.toggled.connect(lambda on: canvas.start_bend_sweep(dialog.get_values()) if on else (canvas.stop_bend_sweep(), canvas.fetch_history(), canvas.render()))
+	dialog.slider.valueChanged.connect(lambda value: canvas.show_bend_sweep(dialog.get_index()))
+	canvas.sweep_index = dialog.get_index()
+	accepted = dialog.exec() == QDialog.Accepted
+	sweep = canvas.stop_bend_sweep()
+	# The preview may have changed the network; start from the last checkpoint again
+	if sweep is not None: canvas.fetch_history()
+	if accepted:
+		bend_cost = dialog.get_value()
+		applied = sweep.apply(dialog.get_index(), canvas.network) if sweep is not None else False
+		if not applied:
+			assign_by_ilp(canvas.network,bend_cost)
+		canvas.history_checkpoint(f"Assign ports globally (bend cost {bend_cost})")
+		if applied is not True:
+			update_layout_if_auto(window)
+	canvas.render()
+
+def do_assign_incremental(window):
+	# Only the free edge ends; the ports that are set stay
 	dialog = BendPenaltyDialog()
 	if dialog.exec() == QDialog.Accepted:
 		bend_cost = dialog.get_value()
-		assign_by_ilp(window.canvas.network,bend_cost)
+		assign_incrementally(window.canvas.network,bend_cost)
+		window.canvas.history_checkpoint(f"Assign free ports globally (bend cost {bend_cost})")
 		update_layout_if_auto(window)
-		window.canvas.history_checkpoint(f"Assign ports globally (bend cost {bend_cost})")
 		window.canvas.render()
+
+def do_assign_cpsat(window):
+	dialog = BendPenaltyDialog()
+	if dialog.exec() == QDialog.Accepted:
+		window.canvas.start_assign_search(dialog.get_value())
 	
 def do_layout(window):
-	if layout_lp(window.canvas.network) is False:
-		logline( "user\t"+"Failed to realize layout.")
-		m = QMessageBox()
-		m.setText("Failed to realize layout.")
-		m.setIcon(QMessageBox.Warning)
-		m.setStandardButtons(QMessageBox.Ok)
-		m.exec()
-	window.canvas.history_checkpoint("Automated layout")
-	if drawing_is_completely_oob(window.canvas):
-		window.canvas.zoom_to_network()
-	window.canvas.render()
+	# Runs in the background; the canvas makes the checkpoint when it is done
+	window.canvas.request_layout( checkpoint="Automated layout" )
 
 def update_layout_if_auto(window):
+	# Lay out the state that was just checkpointed
 	if window.canvas.auto_update.isChecked():
-		do_layout(window)
+		window.canvas.request_layout()
 
 def do_reset_layout(window):
 	for v in window.canvas.network.nodes.values():
 		v.pos = v.geo_pos
 	for e in window.canvas.network.edges:
 		e.bend = None
+	window.canvas.network_changed()
 	window.canvas.zoom_to_network()
 	window.canvas.history_checkpoint("Reset layout")
 	window.canvas.render()
@@ -476,10 +707,9 @@ def do_render(window,tag=None):
 		m.setStandardButtons(QMessageBox.Ok)
 		m.exec()
 	else:
-		export_loom( window.canvas.network, window.canvas.filedata )
 		if tag is None: filename = "render.svg"
 		else: filename = f"{timestring()}-render-{tag}.svg"
-		render_loom( "render.json", filename )
+		window.canvas.start_render( export_loom( window.canvas.network, window.canvas.filedata ), filename )
 
 def construct_sidebar(window,layout):
 	group_separator(layout)
@@ -496,6 +726,12 @@ def construct_sidebar(window,layout):
 	sidebar_button(layout, "Rounding", lambda:do_assign_round(window))
 	sidebar_button(layout, "Matching", lambda:do_assign_matching(window))
 	sidebar_button(layout, "Global...", lambda:do_assign_ilp(window))
+	sidebar_button(layout, "Global, keep set ports...", lambda:do_assign_incremental(window))
+	sidebar_button(layout, "Global (anytime)...", lambda:do_assign_cpsat(window))
+	window.canvas.assign_stop_button = sidebar_button(layout, "Stop search", lambda:window.canvas.stop_assign_search())
+	window.canvas.assign_stop_button.setEnabled(False)
+	window.canvas.assign_label = QLabel("")
+	layout.addWidget(window.canvas.assign_label)
 	
 	group_separator(layout)
 	layout.addWidget(QLabel("Layout"))
@@ -503,6 +739,11 @@ def construct_sidebar(window,layout):
 	window.canvas.auto_update = QCheckBox("Auto-update")
 	window.canvas.auto_update.setChecked(False)
 	layout.addWidget(window.canvas.auto_update)
+	window.canvas.local_update = QCheckBox("Only near edits")
+	window.canvas.local_update.setChecked(False)
+	layout.addWidget(window.canvas.local_update)
+	window.canvas.solving_label = QLabel("")
+	layout.addWidget(window.canvas.solving_label)
 	sidebar_button(layout, "Reset", lambda:do_reset_layout(window))
 
 	group_separator(layout)
@@ -511,6 +752,8 @@ def construct_sidebar(window,layout):
 	window.canvas.auto_render = QCheckBox("Auto-render")
 	window.canvas.auto_render.setChecked(False)
 	layout.addWidget(window.canvas.auto_render)
+	window.canvas.render_label = QLabel("")
+	layout.addWidget(window.canvas.render_label)
 
 	if False:
 		# Checkpoint buttons for user studies
@@ -528,6 +771,7 @@ def sidebar_button(layout, text, action):
 	button = QPushButton(text)
 	button.clicked.connect(action)
 	layout.addWidget(button)
+	return button
 
 def group_separator(layout):
 	line = QFrame()
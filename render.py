@@ -1,8 +1,10 @@
-from PySide6.QtGui import QColor, QPainterPath, QPen, QFont
-from PySide6.QtCore import Qt
+from PySide6.QtGui import QColor, QPainterPath, QPen, QFont, QFontMetricsF
+from PySide6.QtCore import Qt, QPointF
 
 from Network import *
-from math import sqrt
+from math import sqrt, floor, log2
+
+import numpy as np
 
 import ui
 
@@ -20,7 +22,180 @@ port_offset = [ QPointF(-1,0)
 
 font = QFont("Helvetica", 30, QFont.Bold)
 
-def render_network( painter, net, show_labels ):
+# Level of detail: what gets smaller on screen than this many pixels is drawn simpler
+lod_curve_px = 3       # the curves at the nodes (bezier_cp long): edges become polylines
+lod_tolerance_px = 0.5 # and those polylines leave out points this close together
+lod_node_px = 1        # node markers (radius) are left out
+lod_label_px = 6       # labels (font size) are left out
+# Polylines are cut into pieces of this many points, and put together per colour in
+# squares of about this many pixels, so that a tile only draws what is near it
+lod_piece_points = 64
+lod_cell_px = 512
+
+def qpoint( p ):
+    # The network has plain points; Qt wants its own
+    return QPointF( p.x(), p.y() )
+
+def edge_path( e ):
+    a_start = qpoint(e.v[0].pos)
+    if e.free_at(e.v[0]):
+        a_1 = a_start + ui.bezier_radius*qpoint(e.direction(e.v[0]))
+        a_2 = a_start + ui.bezier_cp*qpoint(e.direction(e.v[0]))
+    else:    
+        a_1 = a_start + ui.bezier_radius*port_offset[e.port[0]]
+        a_2 = a_start + ui.bezier_cp*port_offset[e.port[0]]
+
+    b_start = qpoint(e.v[1].pos)
+    if e.free_at(e.v[1]):
+        b_1 = b_start + ui.bezier_radius*qpoint(e.direction(e.v[1]))
+        b_2 = b_start + ui.bezier_cp*qpoint(e.direction(e.v[1]))
+    else:    
+        b_1 = b_start + ui.bezier_radius*port_offset[e.port[1]]
+        b_2 = b_start + ui.bezier_cp*port_offset[e.port[1]]
+
+    path = QPainterPath()
+    if e.free_at(e.v[0]):
+        path.moveTo( a_1 )
+    else:
+        path.moveTo( a_start )
+        path.lineTo( a_1 )
+    if e.bend is None: path.cubicTo( a_2, b_2, b_1 )
+    else:
+        path.lineTo( qpoint(e.bend) )
+        path.lineTo( b_1 )
+    if not e.free_at(e.v[1]):
+        path.lineTo( b_start)
+    return path
+
+class Drawing:
+    # The edge curves of a network, kept between repaints. A curve is built again only
+    # when the positions, ports or bend it was built from change; the curves of each
+    # colour are also kept as one path, so that a whole map is a few drawPath calls.
+    # The canvas sets stale when the network may have changed; until then, nothing is
+    # compared at all.
+    def __init__(self):
+        self.net = None
+        self.stale = True
+        self.keys = []      # per edge: what its curve was built from
+        self.paths = []     # per edge: its curve
+        self.dirty = []     # edges whose curves are out of date
+        self.boxes = np.empty( (0,4) ) # per edge: x0, y0, x1, y1 around its curve
+        self.colors = dict() # color -> indices of its edges, in order
+        self.batches = dict() # color -> all its curves as one path, or None if out of date
+        self.label_width = 0 # of the widest node label
+        self.runs = []       # the edges as runs of one colour, see runs()
+        self.lod = dict()    # level -> color -> the runs as one simplified polyline path
+
+    def update( self, net ):
+        if net is not self.net:
+            self.net = net
+            self.keys = [ None ]*len(net.edges)
+            self.paths = [ None ]*len(net.edges)
+            self.boxes = np.empty( (len(net.edges),4) )
+            self.colors = dict()
+            for i, e in enumerate( net.edges ): self.colors.setdefault( e.color, [] ).append( i )
+            self.batches = dict()
+            metrics = QFontMetricsF( font )
+            self.label_width = max( (metrics.horizontalAdvance(v.name) for v in net.nodes.values()), default=0 )
+            self.runs = runs( net )
+            self.dirty = []
+        elif not self.stale: return
+        for i, e in enumerate( net.edges ):
+            key = (e.v[0].pos, e.v[1].pos, e.port[0], e.port[1], e.bend)
+            if key==self.keys[i]: continue
+            if self.keys[i] is None or key[0] is not self.keys[i][0] or key[1] is not self.keys[i][1] or key[4]!=self.keys[i][4]:
+                self.lod.clear()
+            self.keys[i] = key
+            self.dirty.append( i )
+            self.batches[e.color] = None
+        self.stale = False
+
+    def curves( self ):
+        # Build the curves that are out of date; only needed when they are drawn
+        for i in self.dirty:
+            self.paths[i] = path = edge_path( self.net.edges[i] )
+            self.boxes[i] = box( path.controlPointRect() )
+        self.dirty = []
+
+    def batch( self, color ):
+        if self.batches.get( color ) is None:
+            path = QPainterPath()
+            for i in self.colors[color]: path.addPath( self.paths[i] )
+            self.batches[color] = path
+        return self.batches[color]
+
+    def simplified( self, tolerance ):
+        # The runs as polylines, leaving out points that are closer than tolerance (rounded
+        # down to a power of 2) to the last point drawn. They are cut into pieces, which are
+        # put together by colour and place: (colors, paths, boxes), in drawing order.
+        level = floor( log2( tolerance ) )
+        if level not in self.lod:
+            tolerance = 2.0**level
+            cell = lod_cell_px/lod_tolerance_px*tolerance
+            pieces = dict() # (color, cell x, cell y) -> path
+            for a, edges in self.runs:
+                points = [ a.pos ]
+                v = a
+                for e in edges:
+                    v = e.other(v)
+                    if e.bend is not None: points.append( e.bend )
+                    points.append( v.pos )
+                kept = [ points[0] ]
+                for p in points[1:-1]:
+                    if (p-kept[-1]).length()>=tolerance: kept.append( p )
+                kept.append( points[-1] )
+                for k in range( 0, len(kept)-1, lod_piece_points ):
+                    piece = kept[k:k+lod_piece_points+1]
+                    key = (edges[0].color, floor(piece[0].x()/cell), floor(piece[0].y()/cell))
+                    path = pieces.setdefault( key, QPainterPath() )
+                    path.moveTo( qpoint(piece[0]) )
+                    for p in piece[1:]: path.lineTo( qpoint(p) )
+            order = { color: k for k, color in enumerate( self.colors ) }
+            keys = sorted( pieces, key=lambda key: order[key[0]] )
+            paths = [ pieces[key] for key in keys ]
+            boxes = np.array( [ box(path.boundingRect()) for path in paths ], dtype=np.float64 ).reshape( -1, 4 )
+            self.lod[level] = ( [ key[0] for key in keys ], paths, boxes )
+        return self.lod[level]
+
+def box( r ):
+    return (r.left(), r.top(), r.right(), r.bottom())
+
+def overlapping( boxes, rect, margin ):
+    # Indices of the boxes (x0, y0, x1, y1 per row) that may show in rect, in order
+    x0, y0, x1, y1 = rect.left()-margin, rect.top()-margin, rect.right()+margin, rect.bottom()+margin
+    b = boxes
+    return np.flatnonzero( (b[:,0]<=x1) & (b[:,2]>=x0) & (b[:,1]<=y1) & (b[:,3]>=y0) )
+
+def runs( net ):
+    # The edges as maximal runs through nodes of degree 2 where both edges have the same
+    # colour, as (first node, [edges in order])
+    def onward( v, e ):
+        # The edge after e at v, if the run goes on
+        if len(v.edges)!=2: return None
+        f = v.edges[1] if v.edges[0] is e else v.edges[0]
+        return f if f.color==e.color and f is not e else None
+    result = []
+    seen = set()
+    def walk( a, e ):
+        edges = []
+        v = a
+        while e is not None and id(e) not in seen:
+            seen.add( id(e) )
+            edges.append( e )
+            v = e.other(v)
+            e = onward( v, e )
+        result.append( (a, edges) )
+    for v in net.nodes.values():
+        for e in v.edges:
+            if id(e) not in seen and onward( v, e ) is None: walk( v, e )
+    # What is left are cycles
+    for e in net.edges:
+        if id(e) not in seen: walk( e.v[0], e )
+    return result
+
+def render_network( painter, net, show_labels, drawing=None, rect=None, nodes=None ):
+    # Draw the network; with a Drawing, only what shows in rect (in world coordinates),
+    # with the node index nodes. The UI for the mouse is in render_overlay.
 
     # Coordinate system axes
     painter.setPen(QPen(QColor('lightgray'),10))
@@ -30,71 +205,103 @@ def render_network( painter, net, show_labels ):
     painter.drawLine( 0, 0, 0, 100 )
     painter.drawText( 1, 150, "y" )
 
-    # Draw the edges
-    for e in net.edges:
-        ui.edge_pen.setColor(QColor('#'+e.color))
-        painter.setPen( ui.edge_pen )
-
-        painter.setBrush(Qt.NoBrush )
-
-        a_start = e.v[0].pos
-        if e.free_at(e.v[0]):
-            if e.v[0]==ui.hover_node: a_1 = free_edge_handle_position(e.v[0],e)
-            else: a_1 = e.v[0].pos + (ui.bezier_radius*e.direction(e.v[0])).toPointF()
-            a_2 = e.v[0].pos + (ui.bezier_cp*e.direction(e.v[0])).toPointF()
-        else:    
-            a_1 = e.v[0].pos + ui.bezier_radius*port_offset[e.port[0]]
-            a_2 = e.v[0].pos + ui.bezier_cp*port_offset[e.port[0]]
-
-        b_start = e.v[1].pos
-        if e.free_at(e.v[1]):
-            if e.v[1]==ui.hover_node: b_1 = free_edge_handle_position(e.v[1],e)
-            else: b_1 = e.v[1].pos + (ui.bezier_radius*e.direction(e.v[1])).toPointF()
-            b_2 = e.v[1].pos + (ui.bezier_cp*e.direction(e.v[1])).toPointF()
-        else:    
-            b_1 = e.v[1].pos + ui.bezier_radius*port_offset[e.port[1]]
-            b_2 = e.v[1].pos + ui.bezier_cp*port_offset[e.port[1]]
-
-        path = QPainterPath()
-        if e.free_at(e.v[0]):
-            path.moveTo( a_1 )
-        else:
-            path.moveTo( a_start )
-            path.lineTo( a_1 )
-        if e.bend is None: path.cubicTo( a_2, b_2, b_1 )
+    if drawing is None:
+        drawing = Drawing()
+        rect = None
+    drawing.update( net )
+    painter.setBrush(Qt.NoBrush )
+
+    # Edges in conflict are drawn on their own
+    special = list( ui.conflict )
+    special_ids = { id(e) for e in special }
+
+    # On screen, one unit is this many pixels
+    scale = painter.transform().m11()
+
+    # Draw the edges, one path per colour: the kept one if all of it shows; when the
+    # curves would be too small to see, polylines through the nodes instead
+    margin = ui.conflict_pen.widthF()
+    if ui.bezier_cp*scale<lod_curve_px:
+        colors, pieces, boxes = drawing.simplified( lod_tolerance_px/scale )
+        color = None
+        for k in (range(len(pieces)) if rect is None else overlapping( boxes, rect, margin )):
+            if colors[k]!=color:
+                color = colors[k]
+                ui.edge_pen.setColor(QColor('#'+color))
+                painter.setPen( ui.edge_pen )
+            painter.drawPath( pieces[k] )
+        paths = dict()
+        shown = []
+    else:
+        drawing.curves()
+        shown = None if rect is None else overlapping( drawing.boxes, rect, margin )
+        if shown is None or len(shown)==len(net.edges):
+            paths = { color: drawing.batch( color ) for color in drawing.colors }
+            for e in special: paths.pop( e.color, None )
+            shown = [ i for color, indices in drawing.colors.items() if color not in paths for i in indices ]
         else:
-            path.lineTo( e.bend )
-            path.lineTo( b_1 )
-        if not e.free_at(e.v[1]):
-            path.lineTo( b_start)
-        painter.drawPath(path)
-
-    # Draw UI for the node close to the mouse
-    if ui.hover_node:
-        draw_rose( painter, ui.hover_node )
-        for e in ui.hover_node.edges:
-            if e.free_at(ui.hover_node):
-                painter.setPen( ui.rose_used_pen)
-                painter.setBrush( ui.rose_used_brush )
-                if e==ui.selected_edge: painter.setBrush( ui.selected_brush )
-                if e==ui.hover_edge: painter.setBrush( ui.highlight_brush )
-                handle_pos = free_edge_handle_position(ui.hover_node, e)
-                painter.drawEllipse(handle_pos,ui.handle_radius,ui.handle_radius)
+            paths = dict()
+    for i in shown:
+        e = net.edges[i]
+        if id(e) not in special_ids:
+            paths.setdefault( e.color, QPainterPath() ).addPath( drawing.paths[i] )
+    for color in drawing.colors:
+        if color in paths:
+            ui.edge_pen.setColor(QColor('#'+color))
+            painter.setPen( ui.edge_pen )
+            painter.drawPath( paths[color] )
+    painter.setPen( ui.conflict_pen )
+    for e in special:
+        painter.drawPath( edge_path( e ) )
+
+    # Mark the ports that conflict
+    painter.setPen( Qt.NoPen )
+    painter.setBrush( ui.conflict_brush )
+    for e, ends in ui.conflict.items():
+        for end in ends:
+            if e.port[end] is not None: painter.drawEllipse( handle_position(e.v[end],e.port[end]), ui.handle_radius, ui.handle_radius )
 
     # Draw the nodes
     painter.setPen(ui.node_pen)
     painter.setBrush(ui.node_brush)
-    for name, v in net.nodes.items():
-        painter.drawEllipse(v.pos, 10, 10)
-        if show_labels: painter.drawText( v.pos + QPointF(ui.bezier_radius,10), v.name )
+    markers = 10*scale>=lod_node_px
+    show_labels = show_labels and font.pointSizeF()*scale>=lod_label_px
+    if not markers and not show_labels: shown = []
+    elif rect is None or nodes is None: shown = net.nodes.values()
+    else:
+        # Labels stick out to the right of their node
+        left = ui.bezier_radius+drawing.label_width if show_labels else 0
+        shown = nodes.in_rect( rect.left()-left-20, rect.top()-20, rect.right()+20, rect.bottom()+40 )
+    for v in shown:
+        if markers: painter.drawEllipse(qpoint(v.pos), 10, 10)
+        if show_labels: painter.drawText( qpoint(v.pos) + QPointF(ui.bezier_radius,10), v.name )
 
+def render_overlay( painter, net ):
+    # Draw UI for the node close to the mouse, on top of the drawing
+    if not ui.hover_node: return
+    # Its free edges reach out to their handles; the rest of their curves is in the drawing
+    for e in ui.hover_node.edges:
+        if e.free_at(ui.hover_node):
+            ui.edge_pen.setColor(QColor('#'+e.color))
+            painter.setPen( ui.conflict_pen if e in ui.conflict else ui.edge_pen )
+            start = qpoint(ui.hover_node.pos) + ui.bezier_radius*qpoint(e.direction(ui.hover_node))
+            painter.drawLine( start, free_edge_handle_position(ui.hover_node, e) )
+    draw_rose( painter, ui.hover_node )
+    for e in ui.hover_node.edges:
+        if e.free_at(ui.hover_node):
+            painter.setPen( ui.rose_used_pen)
+            painter.setBrush( ui.rose_used_brush )
+            if e==ui.selected_edge: painter.setBrush( ui.selected_brush )
+            if e==ui.hover_edge: painter.setBrush( ui.highlight_brush )
+            handle_pos = free_edge_handle_position(ui.hover_node, e)
+            painter.drawEllipse(handle_pos,ui.handle_radius,ui.handle_radius)
 
 def handle_position( v, p ):
-    return v.pos + ui.rose_radius*port_offset[p]
+    return qpoint(v.pos) + ui.rose_radius*port_offset[p]
 
 def free_edge_handle_position( v, e ):
-    dir = e.direction(v).toPointF()
-    return v.pos + 2*ui.rose_radius*dir
+    dir = qpoint(e.direction(v))
+    return qpoint(v.pos) + 2*ui.rose_radius*dir
 
 def is_hovered( v, i ):
     if v!=ui.hover_node: return False
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from threading import Lock
+
+from PySide6.QtCore import QObject, Signal
+
+from fileformat_loom import render_loom
+
+# Loom renders off the GUI thread. A few run at a time, each in a folder of its own; the
+# result is moved to its output file when it is done. A job for an output file that
+# already has a job waiting or running replaces it: the old one is dropped, and its loom
+# and transitmap are killed. Renders are kept by the hash of the Loom data they were made
+# from, so the same layout is not rendered again.
+
+# How many renders may run at once
+render_workers = 2
+# How many renders (SVG text) to remember
+render_cache_size = 32
+
+class RenderJob:
+    def __init__(self, data, output):
+        self.data = data        # Loom data with our layout, as JSON text
+        self.output = output    # the SVG file to write
+        self.key = blake2b( data.encode(), digest_size=16 ).digest()
+        self.future = None
+        self.processes = []
+        self.cancelled = False
+        self.cached = False     # whether the render came from the cache
+        self.error = None       # why it failed, if it did
+
+class RenderManager(QObject):
+    done = Signal(object) # a RenderJob that finished (see its error); cancelled ones are not reported
+
+    def __init__(self):
+        super().__init__()
+        self.pool = ThreadPoolExecutor( max_workers=render_workers )
+        self.lock = Lock()
+        self.jobs = dict()  # output -> its newest job, until that is done
+        self.cache = OrderedDict() # key -> SVG bytes
+
+    def submit( self, data, output ):
+        # Render the Loom data (JSON text) to output; returns the job
+        job = RenderJob( data, output )
+        with self.lock:
+            old = self.jobs.get( output )
+            if old is not None and old.key==job.key: return old
+            if old is not None: self.cancel( old )
+            self.jobs[output] = job
+            job.future = self.pool.submit( self.run, job )
+        return job
+
+    def busy( self ):
+        with self.lock:
+            return len(self.jobs)>0
+
+    def stop( self ):
+        # Cancel everything and wait for the workers
+        with self.lock:
+            for job in self.jobs.values(): self.cancel( job )
+            self.jobs.clear()
+        self.pool.shutdown( wait=True )
+
+    def cancel( self, job ):
+        # With the lock held
+        job.cancelled = True
+        job.future.cancel()
+        for p in job.processes: p.kill()
+
+    def run( self, job ):
+        with self.lock:
+            svg = self.cache.get( job.key )
+            if svg is not None: self.cache.move_to_end( job.key )
+        job.cached = svg is not None
+        if svg is None:
+            svg = self.render( job )
+        if svg is not None and not job.cancelled:
+            try:
+                with open( job.output+".tmp", 'wb' ) as fp:
+                    fp.write( svg )
+                os.replace( job.output+".tmp", job.output )
+            except OSError as error:
+                job.error = str(error)
+        with self.lock:
+            if job.cancelled: return
+            if self.jobs.get( job.output ) is job: del self.jobs[job.output]
+        self.done.emit( job )
+
+    def render( self, job ):
+        # The SVG for the job, or None
+        folder = tempfile.mkdtemp( prefix="mooey-render-" )
+        try:
+            fname_in = os.path.join( folder, "render.json" )
+            fname_out = os.path.join( folder, "render.svg" )
+            with open( fname_in, 'w' ) as fp:
+                fp.write( job.data )
+            with self.lock:
+                if job.cancelled: return None
+                try:
+                    job.processes = render_loom( fname_in, fname_out )
+                except OSError as error:
+                    job.error = f"Could not run Loom: {error}"
+                    return None
+            codes = [ p.wait() for p in job.processes ]
+            if job.cancelled: return None
+            if any( codes ):
+                job.error = f"Loom failed (exit codes {codes})"
+                return None
+            with open( fname_out, 'rb' ) as fp:
+                svg = fp.read()
+            with self.lock:
+                self.cache[job.key] = svg
+                if len(self.cache)>render_cache_size: self.cache.popitem( last=False )
+            return svg
+        finally:
+            shutil.rmtree( folder, ignore_errors=True )
@@ -0,0 +1,96 @@
+# Which ortools solver to use, and with which settings, for the layout LP and the port
+# assignment ILP. Every solve is recorded with its model size and runtime, so that the
+# backend for a network size can be picked from measurements rather than guessed.
+# Worker processes import this module, so it must not pull in Qt or the GUI.
+
+from time import perf_counter
+
+from ortools.linear_solver import pywraplp as lp
+
+# How many solves to remember
+max_stats = 10000
+
+class SolverConfig:
+    def __init__( self, backend, threads=None, time_limit=None, tolerance=None, gap=None, parameters="" ):
+        self.backend = backend       # an ortools solver id: GLOP, PDLP, CLP, HiGHS, SCIP, CP-SAT, ...
+        self.threads = threads       # None for the solver's default
+        self.time_limit = time_limit # seconds
+        self.tolerance = tolerance   # primal and dual feasibility tolerance
+        self.gap = gap               # relative MIP gap
+        self.parameters = parameters # solver specific, in its own text format
+
+    def key( self ):
+        # Settings that can change the answer; results are cached by this
+        return ( self.backend, self.time_limit, self.tolerance, self.gap, self.parameters )
+
+    def with_backend( self, backend, parameters=None ):
+        # parameters: the solver specific ones for the new backend; by default these
+        if parameters is None: parameters = self.parameters
+        return SolverConfig( backend, self.threads, self.time_limit, self.tolerance, self.gap, parameters )
+
+    def create( self, parameters="" ):
+        # A new solver with these settings; parameters are added to the solver specific ones
+        solver = lp.Solver.CreateSolver( self.backend )
+        if solver is None:
+            raise ValueError( "Solver backend not available: "+self.backend )
+        if self.threads is not None:
+            solver.SetNumThreads( self.threads )
+        if self.time_limit is not None:
+            solver.SetTimeLimit( int(1000*self.time_limit) )
+        parameters = "\n".join( p for p in (self.parameters, parameters) if p )
+        if parameters:
+            solver.SetSolverSpecificParametersAsString( parameters )
+        return solver
+
+    def solve( self, solver, model ):
+        # Solve and record it under the name of the model ("layout", "assign", ...)
+        params = lp.MPSolverParameters()
+        if self.tolerance is not None:
+            params.SetDoubleParam( lp.MPSolverParameters.PRIMAL_TOLERANCE, self.tolerance )
+            params.SetDoubleParam( lp.MPSolverParameters.DUAL_TOLERANCE, self.tolerance )
+        if self.gap is not None:
+            params.SetDoubleParam( lp.MPSolverParameters.RELATIVE_MIP_GAP, self.gap )
+        start = perf_counter()
+        status = solver.Solve( params )
+        record( model, self.backend, solver.NumVariables(), solver.NumConstraints(), perf_counter()-start, status, self.threads )
+        return status
+
+layout_config = SolverConfig( 'GLOP' )
+assign_config = SolverConfig( 'SCIP' )
+# For assign.CpSatSearch: threads are its workers, which search in different ways, so
+# even on few cores it should have several
+cpsat_config = SolverConfig( 'CP-SAT', threads=8, time_limit=60 )
+
+
+### MEASUREMENTS ###
+
+stats = [] # dicts with model, backend, variables, constraints, seconds, status, threads
+
+def record( model, backend, variables, constraints, seconds, status, threads=None ):
+    stats.append( dict( model=model, backend=backend, variables=variables, constraints=constraints, seconds=seconds, status=status, threads=threads ) )
+    if len(stats)>max_stats: del stats[:len(stats)-max_stats]
+
+def drain():
+    # Take the records made so far (worker processes hand theirs back this way)
+    records = stats[:]
+    stats.clear()
+    return records
+
+def size_class( variables ):
+    # Sizes within a factor two are compared with each other
+    return max( variables, 1 ).bit_length()
+
+def summary( model ):
+    # (backend, size class) -> (number of solves, mean seconds) over the optimal solves
+    total = dict()
+    for s in stats:
+        if s['model']!=model or s['status']!=lp.Solver.OPTIMAL: continue
+        key = ( s['backend'], size_class(s['variables']) )
+        count, seconds = total.get( key, (0,0) )
+        total[key] = ( count+1, seconds+s['seconds'] )
+    return { key: (count, seconds/count) for key, (count, seconds) in total.items() }
+
+def fastest_backend( model, variables, default=None ):
+    # The backend with the lowest mean time on models of about this size, if any was measured
+    times = [ (seconds,backend) for (backend,size), (_,seconds) in summary(model).items() if size==size_class(variables) ]
+    return min(times)[1] if times else default
@@ -0,0 +1,52 @@
+from math import inf
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# A k-d tree over the node positions of a network, for the GUI: which node is under the
+# mouse, and where the drawing is. Nodes are moved by setting their pos, so the index
+# cannot see it happen; whoever moves them builds a new one (the canvas does so lazily,
+# on the first query after a change).
+
+class NodeIndex:
+    def __init__(self, net):
+        self.nodes = list( net.nodes.values() )
+        self.positions = np.array( [ (v.pos.x(),v.pos.y()) for v in self.nodes ], dtype=np.float64 ).reshape( -1, 2 )
+        self.tree = cKDTree( self.positions ) if self.nodes else None
+        if self.nodes:
+            self.min = self.positions.min( axis=0 )
+            self.max = self.positions.max( axis=0 )
+
+    def nearest(self, x, y, radius=inf):
+        # The node closest to (x,y) that is closer than radius, or None
+        if self.tree is None: return None
+        dist, i = self.tree.query( (x,y), distance_upper_bound=radius )
+        if dist>=radius: return None
+        return self.nodes[i]
+
+    def bounds(self):
+        # (min x, min y, max x, max y) of the nodes, or None if there are none
+        if self.tree is None: return None
+        return (self.min[0], self.min[1], self.max[0], self.max[1])
+
+    def in_rect(self, x0, y0, x1, y1):
+        # The nodes in the rectangle
+        if self.tree is None: return []
+        if x0<=self.min[0] and y0<=self.min[1] and x1>=self.max[0] and y1>=self.max[1]: return self.nodes
+        center = ((x0+x1)/2, (y0+y1)/2)
+        half = np.array( ((x1-x0)/2, (y1-y0)/2) )
+        near = np.array( self.tree.query_ball_point( center, half.max(), p=inf ), dtype=np.intp )
+        inside = near[ np.all( np.abs( self.positions[near]-center )<=half, axis=1 ) ]
+        return [ self.nodes[i] for i in np.sort( inside ) ]
+
+    def any_in_rect(self, x0, y0, x1, y1):
+        # Is there a node in the rectangle?
+        if self.tree is None: return False
+        center = ((x0+x1)/2, (y0+y1)/2)
+        half = np.array( ((x1-x0)/2, (y1-y0)/2) )
+        dist, _ = self.tree.query( center, p=inf )
+        if dist<=half.min(): return True
+        if dist>half.max(): return False
+        # Nearest in the square around the rectangle, but maybe not in the rectangle itself
+        near = self.positions[ self.tree.query_ball_point( center, half.max(), p=inf ) ]
+        return bool( np.any( np.all( np.abs( near-center )<=half, axis=1 ) ) )
@@ -0,0 +1,202 @@
+# Port assignment and layout for a whole range of bend costs, so that the Bend Penalty
+# dialog can show the design for any slider value without waiting.
+#
+# The optimal objective as a function of the bend cost is the minimum of one line per
+# assignment (angle cost + bend cost * bends), so if the same assignment is optimal at
+# two bend costs, it is optimal at every cost in between. The sweep therefore solves the
+# two ends of the range and only bisects where the answers differ; every distinct
+# assignment then gets one layout. The solves of each round go to the worker processes
+# of layout_solver at once. Networks travel there as CompactNetwork, which pickles.
+# Worker processes import this module, so it must not pull in Qt or the GUI.
+# A stopped sweep does not wait for the solves it already gave to the workers: they
+# finish there, and their results are thrown away.
+
+from collections import OrderedDict
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from hashlib import blake2b
+from math import inf
+from threading import Lock
+from time import perf_counter
+
+import numpy as np
+
+import assign
+import layout
+import layout_solver
+import solvers
+from CompactNetwork import CompactNetwork
+from Network import Point
+from log import logline
+
+# How many (network, bend cost) assignments to remember
+sweep_cache_size = 4096
+
+sweep_cache = OrderedDict() # (network key, bend cost) -> choice
+sweep_cache_lock = Lock()   # sweeps run on threads of their own
+
+def network_key( net, config ):
+    # Everything the assignment depends on besides the bend cost
+    h = blake2b( digest_size=16 )
+    h.update( repr(layout.network_structure(net)).encode() )
+    h.update( np.array( [ (v.geo_pos.x(),v.geo_pos.y()) for v in net.nodes.values() ] ).tobytes() )
+    h.update( repr( (assign.ilp_candidates,assign.ilp_candidate_angle,assign.ilp_chains,config.key()) ).encode() )
+    return h.digest()
+
+def solve_assignment( compact, bend_cost, config ):
+    # Runs in a worker process: the choice of assign_by_ilp, or None
+    solvers.drain()
+    net = compact.to_network()
+    assign.assign_by_ilp( net, bend_cost, config )
+    choice = tuple( e.port[0] for e in net.edges )
+    if None in choice: choice = None
+    return choice, solvers.drain()
+
+def solve_layout( compact, config ):
+    # Runs in a worker process: (positions, bends) as flat arrays, or None
+    solvers.drain()
+    layout_solver.parallel_min_rows = inf # no pool of its own in here
+    net = compact.to_network()
+    if layout.layout_lp( net, None, config ) is False: return None, solvers.drain()
+    positions = np.array( [ (v.pos.x(),v.pos.y()) for v in net.nodes.values() ] ).reshape(-1)
+    bends = np.array( [ (np.nan,np.nan) if e.bend is None else (e.bend.x(),e.bend.y()) for e in net.edges ] ).reshape(-1)
+    return (positions, bends), solvers.drain()
+
+class BendSweep:
+    def __init__( self, net, costs, assign_config:solvers.SolverConfig = None, layout_config:solvers.SolverConfig = None ):
+        self.net = net.clone()     # belongs to the sweep from now on
+        self.costs = list( costs ) # bend costs, in increasing order
+        self.assign_config = assign_config or solvers.assign_config
+        self.layout_config = layout_config or solvers.layout_config
+        self.choices = [ None ]*len(self.costs) # per bend cost: the choice, once known
+        self.layouts = dict()      # choice -> (positions, bends), or None if it has no layout
+        self.lock = Lock()         # the GUI reads while run() writes
+        self.futures = set()
+        self.stopped = False
+        self.wakeup = Future()     # done when the sweep is stopped
+        self.solved = 0            # assignments solved (not from the cache)
+
+    def stop( self ):
+        # Safe to call from any thread; run() returns soon after
+        with self.lock:
+            self.stopped = True
+            for future in self.futures: future.cancel()
+        if not self.wakeup.done(): self.wakeup.set_result( None )
+
+    def completed( self, futures ):
+        # Like as_completed, but leaves off as soon as the sweep is stopped
+        pending = set( futures )
+        while pending and not self.stopped:
+            done, pending = wait( pending | {self.wakeup}, return_when=FIRST_COMPLETED )
+            pending.discard( self.wakeup )
+            for future in done:
+                if future is self.wakeup or future.cancelled(): continue
+                if self.stopped: return
+                yield future
+
+    def design( self, i ):
+        # (choice, layout) for the i-th bend cost; either may be None while not known yet
+        with self.lock:
+            choice = self.choices[i]
+            return choice, self.layouts.get( choice )
+
+    def apply( self, i, net ):
+        # Put the design for the i-th bend cost on the network; returns what it could
+        # apply: False for nothing, "ports" for the assignment only, True for everything
+        choice, result = self.design( i )
+        if choice is None: return False
+        assign.apply_choice( net, choice )
+        if result is None: return "ports"
+        put_layout( net, result )
+        return True
+
+    def run( self, progress=None ):
+        # progress( indices ) is called whenever the designs for those bend costs improve
+        start = perf_counter()
+        progress = progress or (lambda indices: None)
+        key = network_key( self.net, self.assign_config )
+        compact = CompactNetwork.from_network( self.net )
+        pool = layout_solver.worker_pool()
+        layout_futures = dict()
+
+        def learn( i, choice ):
+            with self.lock:
+                self.choices[i] = choice
+            if choice is not None and choice not in layout_futures and not self.stopped:
+                ported = compact.clone()
+                assign.apply_choice( ported, choice )
+                layout_futures[choice] = self.submit( pool, solve_layout, ported, self.layout_config )
+
+        n = len(self.costs)
+        todo = sorted( {0, n-1} )
+        intervals = [ (0,n-1) ] if n>1 else []
+        while todo and not self.stopped:
+            futures = dict()
+            for i in todo:
+                with sweep_cache_lock:
+                    choice = sweep_cache.get( (key,self.costs[i]) )
+                    if choice is not None: sweep_cache.move_to_end( (key,self.costs[i]) )
+                if choice is not None:
+                    learn( i, choice )
+                else:
+                    futures[self.submit( pool, solve_assignment, compact, self.costs[i], self.assign_config )] = i
+            for future in self.completed( futures ):
+                i = futures[future]
+                choice, records = future.result()
+                for r in records: solvers.record( **r )
+                self.solved += 1
+                if choice is not None:
+                    with sweep_cache_lock:
+                        sweep_cache[(key,self.costs[i])] = choice
+                        if len(sweep_cache)>sweep_cache_size: sweep_cache.popitem( last=False )
+                learn( i, choice )
+            if self.stopped: break
+            progress( todo )
+
+            # Same assignment at both ends: it holds in between as well
+            todo = []
+            remaining = []
+            for lo, hi in intervals:
+                if hi-lo<2: continue
+                if self.choices[lo] is not None and self.choices[lo]==self.choices[hi]:
+                    with self.lock:
+                        for i in range( lo+1, hi ): self.choices[i] = self.choices[lo]
+                    progress( list(range(lo+1,hi)) )
+                else:
+                    mid = (lo+hi)//2
+                    todo.append( mid )
+                    remaining += [ (lo,mid), (mid,hi) ]
+            intervals = remaining
+
+        choices = { future: choice for choice, future in layout_futures.items() }
+        for future in self.completed( choices ):
+            result, records = future.result()
+            for r in records: solvers.record( **r )
+            choice = choices[future]
+            with self.lock:
+                self.layouts[choice] = result
+            if result is not None: self.cache_layout( choice, result )
+            progress( [ i for i, c in enumerate(self.choices) if c==choice ] )
+        runtime = perf_counter()-start
+        logline( "sweep\tBend cost sweep runtime (s)\t" + str(runtime) )
+        logline( "stats\tBend cost sweep (bend costs, solved, layouts)\t"+str(len(self.costs))+", "+str(self.solved)+", "+str(len(layout_futures)) )
+
+    def submit( self, pool, *args ):
+        with self.lock:
+            future = pool.submit( *args )
+            self.futures.add( future )
+            if self.stopped: future.cancel()
+        return future
+
+    def cache_layout( self, choice, result ):
+        # So that a layout of this design later on comes from the cache
+        net = self.net.clone()
+        assign.apply_choice( net, choice )
+        put_layout( net, result )
+        layout.layout_cache.put( layout.fingerprint( net, self.layout_config ), net )
+
+def put_layout( net, result ):
+    positions, bends = result
+    for v, x, y in zip( net.nodes.values(), positions[0::2], positions[1::2] ):
+        v.set_position( x, y )
+    for e, x, y in zip( net.edges, bends[0::2], bends[1::2] ):
+        e.bend = None if np.isnan(x) else Point( x, y )
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from math import floor, log
+
+from PySide6.QtGui import QPixmap, QPainter, QColor, QTransform
+from PySide6.QtCore import QRectF
+
+# A raster cache of the drawing, so that panning and zooming do not draw the network
+# again for every event. The drawing is cut into square tiles of tile_size pixels at the
+# view scale and sub-pixel offset they were drawn at, so that they go onto the widget at
+# whole pixels. Painting at some view blits the tiles of its scale and offset and draws
+# the ones that are missing; during a gesture, it draws only a few and shows the rest
+# from other tiles, stretched to the view. Whatever depends on the mouse goes on top of
+# the tiles, not in them.
+
+tile_size = 512
+# Tiles to keep (of tile_size^2 pixels each), over all scales
+tile_cache_size = 48
+# During a gesture, draw at most this many missing tiles per paint
+gesture_tiles_per_paint = 2
+# Sub-pixel offsets are rounded to this fraction of a pixel
+tile_phases = 8
+
+class TileCache:
+    def __init__(self):
+        self.tiles = OrderedDict() # (scale, variant, phase x, phase y, i, j) -> QPixmap
+        self.scale = None # of the last paint
+
+    def clear(self):
+        # The drawing changed
+        self.tiles.clear()
+
+    def paint(self, painter, view, size, draw, variant=None, gesture=False):
+        # Fill the widget (size) with the drawing at view, which only scales and translates.
+        # draw( painter, rect ) draws the world rectangle rect; variant tells apart drawings
+        # of the same network that look different (e.g. with labels).
+        t = tile_size
+        dx = round( view.dx()*tile_phases )/tile_phases
+        dy = round( view.dy()*tile_phases )/tile_phases
+        # Tile (i,j) goes at widget pixel (i*t+x0, j*t+y0)
+        x0, y0 = floor(dx), floor(dy)
+        level = (view.m11(), variant, dx-x0, dy-y0)
+        needed = [ (i,j) for j in range( floor(-y0/t), floor((size.height()-y0)/t)+1 )
+                         for i in range( floor(-x0/t), floor((size.width()-x0)/t)+1 ) ]
+        missing = [ ij for ij in needed if level+ij not in self.tiles ]
+        if gesture and missing:
+            # Tiles drawn at a scale that is passed while zooming are not seen again
+            if self.paint_others( painter, view, size, level ) and level[0]!=self.scale: missing = []
+            else: missing = missing[:gesture_tiles_per_paint]
+        self.scale = level[0]
+        for i, j in missing:
+            self.tiles[level+(i,j)] = draw_tile( draw, level, i, j )
+        for i, j in needed:
+            key = level+(i,j)
+            if key not in self.tiles: continue
+            self.tiles.move_to_end( key )
+            painter.drawPixmap( i*t+x0, j*t+y0, self.tiles[key] )
+        while len(self.tiles)>tile_cache_size:
+            self.tiles.popitem( last=False )
+
+    def paint_others(self, painter, view, size, level):
+        # Paint the other tiles that show, the nearest scale last (on top); were there any?
+        s, variant = level[:2]
+        area = QRectF( 0, 0, size.width(), size.height() )
+        shown = []
+        for key, pixmap in self.tiles.items():
+            if key[1]!=variant or key[:4]==level: continue
+            target = view.mapRect( tile_rect( key ) )
+            if target.intersects( area ): shown.append( (abs(log(key[0]/s)), target, pixmap) )
+        shown.sort( key=lambda item: -item[0] )
+        for _, target, pixmap in shown:
+            painter.drawPixmap( target, pixmap, QRectF( pixmap.rect() ) )
+        return len(shown)>0
+
+def tile_rect( key ):
+    # The world rectangle of a tile
+    s, _, fx, fy, i, j = key
+    t = tile_size
+    return QRectF( (i*t-fx)/s, (j*t-fy)/s, t/s, t/s )
+
+def draw_tile( draw, level, i, j ):
+    s, _, fx, fy = level
+    t = tile_size
+    pixmap = QPixmap( t, t )
+    pixmap.fill( QColor('white') )
+    painter = QPainter( pixmap )
+    painter.setRenderHint( QPainter.Antialiasing )
+    painter.setTransform( QTransform( s, 0, 0, s, fx-i*t, fy-j*t ) )
+    draw( painter, tile_rect( level+(i,j) ) )
+    painter.end()
+    return pixmap
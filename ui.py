@@ -11,6 +11,9 @@ hover_empty_port = None
 selected_node = None
 selected_edge = None
 
+# Edge -> ends whose ports made the last layout fail
+conflict = dict()
+
 ### Pens and brushes
 
 node_pen = QPen( QColor('black'), 5 )
@@ -23,6 +26,8 @@ rose_used_pen = QPen( QColor('black'), 2 )
 rose_used_brush = QBrush( QColor('lightgray') )
 
 edge_pen = QPen( QColor('black'), 2 )
+conflict_pen = QPen( QColor('red'), 2 )
+conflict_brush = QBrush( QColor('red') )
 
 highlight_brush = QBrush( QColor('orange'))
 selected_brush = QBrush( QColor('yellow'))
@@ -39,6 +44,7 @@ handle_radius = 20
 def update_params( view_scale ):
     # Set some of the pens widths based on zoom level (so they don't go invisible)
     edge_pen.setWidthF( max(4,0.35/view_scale) )    
+    conflict_pen.setWidthF( 3*edge_pen.widthF() )
     # Set some of the widget scales based on zoom level (so they don't get too small)
     global rose_radius
     rose_radius = max( 20, 15/view_scale )